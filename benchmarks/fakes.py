@@ -0,0 +1,644 @@
+"""In-process stand-ins for the pydrive2, gspread, gspread_dataframe, s3path, boto3 and clearml surfaces used by
+clowder's Environment. Every call that would reach a remote service is counted by operation and delayed by a
+configurable latency, so that benchmarks measure how many round trips each code path makes and how long they take"""
+
+import datetime
+import hashlib
+import io
+import itertools
+import re
+import sys
+import types
+from collections import Counter
+from enum import Enum
+from threading import Lock
+from time import sleep
+from typing import Optional
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+SPREADSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+
+
+class Backend:
+    """Counts calls per operation and injects latency into each of them"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = Lock()
+        self._ids = itertools.count()
+
+    def call(self, operation: str):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency > 0:
+            sleep(self.latency)
+
+    def new_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+
+
+# Google Drive (pydrive2)
+
+
+class ApiRequestError(IOError):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.error = {"code": code, "message": message}
+
+
+class FakeMediaIo:
+    def __init__(self, content: bytes, chunksize: int) -> None:
+        self._content = content
+        self._chunksize = chunksize
+        self._offset = 0
+        self._done = False
+
+    def read(self) -> Optional[bytes]:
+        if self._done:
+            return None
+        chunk = self._content[self._offset : self._offset + self._chunksize]
+        self._offset += self._chunksize
+        self._done = self._offset >= len(self._content)
+        return chunk
+
+    def __iter__(self):
+        while True:
+            chunk = self.read()
+            if chunk is None:
+                break
+            yield chunk
+
+
+class FakeDriveFile(dict):
+    def __init__(self, drive: "FakeGoogleDrive", metadata: dict) -> None:
+        super().__init__(metadata)
+        self._drive = drive
+        self._content: Optional[bytes] = None
+
+    def __getitem__(self, key):
+        # pydrive2 fetches metadata lazily when a field of a file created by id is read
+        if key not in self and "id" in self:
+            self.FetchMetadata()
+        return super().__getitem__(key)
+
+    def FetchMetadata(self, fields: Optional[str] = None):
+        self._drive.backend.call("drive.get")
+        self.update(self._drive.metadata(self["id"]))
+
+    def SetContentString(self, content: str):
+        self._content = content.encode("utf-8")
+
+    def GetContentString(self) -> str:
+        self._drive.backend.call("drive.download")
+        return self._drive.content(self["id"]).decode("utf-8")
+
+    def GetContentIOBuffer(self, chunksize: int = 100 * 1024 * 1024, **kwargs) -> FakeMediaIo:
+        self._drive.backend.call("drive.download")
+        return FakeMediaIo(self._drive.content(self["id"]), chunksize)
+
+    def Upload(self, param: Optional[dict] = None):
+        self._drive.backend.call("drive.upload")
+        self.update(self._drive.upload(dict(self), self._content))
+
+    def Delete(self, param: Optional[dict] = None):
+        self._drive.backend.call("drive.delete")
+        self._drive.delete(self["id"])
+
+
+class FakeFileList:
+    def __init__(self, drive: "FakeGoogleDrive", query: str) -> None:
+        self._drive = drive
+        self._parents = set(re.findall(r"'([^']+)' in parents", query))
+
+    def GetList(self) -> "list[FakeDriveFile]":
+        self._drive.backend.call("drive.list")
+        return [FakeDriveFile(self._drive, metadata) for metadata in self._drive.children(self._parents)]
+
+
+class FakeGoogleDrive:
+    def __init__(self, backend: Backend) -> None:
+        self.backend = backend
+        self._files: dict[str, dict] = {}
+        self._contents: dict[str, bytes] = {}
+        self._lock = Lock()
+
+    def ListFile(self, param: dict) -> FakeFileList:
+        return FakeFileList(self, param["q"])
+
+    def CreateFile(self, metadata: Optional[dict] = None) -> FakeDriveFile:
+        return FakeDriveFile(self, metadata or {})
+
+    def metadata(self, file_id: str) -> dict:
+        with self._lock:
+            if file_id not in self._files:
+                raise ApiRequestError(404, f"File not found: {file_id}")
+            return dict(self._files[file_id])
+
+    def content(self, file_id: str) -> bytes:
+        with self._lock:
+            if file_id not in self._files:
+                raise ApiRequestError(404, f"File not found: {file_id}")
+            return self._contents.get(file_id, b"")
+
+    def children(self, parent_ids: "set[str]") -> "list[dict]":
+        with self._lock:
+            return [
+                dict(metadata)
+                for metadata in self._files.values()
+                if any(parent["id"] in parent_ids for parent in metadata["parents"])
+            ]
+
+    def upload(self, metadata: dict, content: Optional[bytes]) -> dict:
+        with self._lock:
+            now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            if "id" in metadata:
+                if metadata["id"] not in self._files:
+                    raise ApiRequestError(404, f"File not found: {metadata['id']}")
+                stored = self._files[metadata["id"]]
+                stored["version"] += 1
+                stored["modifiedDate"] = now
+            else:
+                stored = {
+                    "id": self.backend.new_id("drive"),
+                    "title": metadata["title"],
+                    "mimeType": metadata.get("mimeType", "text/plain"),
+                    "parents": metadata.get("parents", []),
+                    "version": 1,
+                    "modifiedDate": now,
+                }
+                self._files[stored["id"]] = stored
+            if content is not None:
+                self._contents[stored["id"]] = content
+            return dict(stored)
+
+    def touch(self, file_id: str):
+        """Records a change to a file made through another API, e.g. a Sheets edit"""
+        with self._lock:
+            self._files[file_id]["version"] += 1
+            self._files[file_id]["modifiedDate"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def delete(self, file_id: str):
+        with self._lock:
+            to_delete = [file_id]
+            while len(to_delete) > 0:
+                current = to_delete.pop()
+                self._files.pop(current, None)
+                self._contents.pop(current, None)
+                to_delete.extend(
+                    child_id
+                    for child_id, metadata in self._files.items()
+                    if any(parent["id"] == current for parent in metadata["parents"])
+                )
+
+    def write_file(self, parent_id: str, title: str, content: str) -> str:
+        """Creates or replaces a file without counting it as an API call, for seeding benchmark data"""
+        with self._lock:
+            existing = [
+                file_id
+                for file_id, metadata in self._files.items()
+                if metadata["title"] == title and any(parent["id"] == parent_id for parent in metadata["parents"])
+            ]
+        if len(existing) > 0:
+            return self.upload({"id": existing[0]}, content.encode("utf-8"))["id"]
+        return self.upload({"title": title, "parents": [{"id": parent_id}]}, content.encode("utf-8"))["id"]
+
+
+# Google Sheets (gspread, gspread_dataframe)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: "FakeSpreadsheet", title: str, sheet_id: int) -> None:
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.records: list[dict] = []
+
+    def get_all_records(self) -> "list[dict]":
+        self.spreadsheet.backend.call("sheets.read")
+        return [dict(record) for record in self.records]
+
+    def update_title(self, title: str):
+        self.spreadsheet.write()
+        self.title = title
+
+    def set_records(self, records: "list[dict]"):
+        self.spreadsheet.write()
+        self.records = records
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: "FakeGspreadClient", spreadsheet_id: str) -> None:
+        self.client = client
+        self.backend = client.backend
+        self.id = spreadsheet_id
+        self._worksheets = [FakeWorksheet(self, "Sheet1", 0)]
+        self._sheet_ids = itertools.count(1)
+
+    def write(self):
+        self.backend.call("sheets.write")
+        self.client.drive.touch(self.id)
+
+    @property
+    def sheet1(self) -> FakeWorksheet:
+        return self._worksheets[0]
+
+    def worksheets(self) -> "list[FakeWorksheet]":
+        self.backend.call("sheets.read")
+        return list(self._worksheets)
+
+    def add_worksheet(self, title: str, rows: int, cols: int) -> FakeWorksheet:
+        self.write()
+        worksheet = FakeWorksheet(self, title, next(self._sheet_ids))
+        self._worksheets.append(worksheet)
+        return worksheet
+
+    def del_worksheet(self, worksheet: FakeWorksheet):
+        self.write()
+        self._worksheets.remove(worksheet)
+
+    def batch_update(self, body: dict) -> dict:
+        self.write()
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+
+class FakeGspreadClient:
+    def __init__(self, backend: Backend, drive: FakeGoogleDrive) -> None:
+        self.backend = backend
+        self.drive = drive
+        self._spreadsheets: dict[str, FakeSpreadsheet] = {}
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.backend.call("sheets.read")
+        return self._spreadsheets[key]
+
+    def create(self, title: str, folder_id: Optional[str] = None) -> FakeSpreadsheet:
+        self.backend.call("sheets.write")
+        metadata = self.drive.upload(
+            {
+                "title": title,
+                "mimeType": SPREADSHEET_MIME_TYPE,
+                "parents": [{"id": folder_id}] if folder_id is not None else [],
+            },
+            None,
+        )
+        self._spreadsheets[metadata["id"]] = FakeSpreadsheet(self, metadata["id"])
+        return self._spreadsheets[metadata["id"]]
+
+
+def set_with_dataframe(worksheet: FakeWorksheet, df, include_index: bool = False, **kwargs):
+    if include_index:
+        df = df.reset_index()
+    worksheet.set_records(df.to_dict("records"))
+
+
+# S3 (s3path, boto3)
+
+
+class FakeS3Store:
+    def __init__(self, backend: Backend) -> None:
+        self.backend = backend
+        self.objects: dict[str, tuple[bytes, datetime.datetime]] = {}
+        self._lock = Lock()
+
+    def put(self, full_key: str, content: bytes):
+        with self._lock:
+            self.objects[full_key] = (content, datetime.datetime.now(datetime.timezone.utc))
+
+    def get(self, full_key: str) -> bytes:
+        with self._lock:
+            if full_key not in self.objects:
+                raise FileNotFoundError(full_key)
+            return self.objects[full_key][0]
+
+    def delete(self, full_key: str):
+        with self._lock:
+            self.objects.pop(full_key, None)
+
+    def list(self, prefix: str) -> "list[tuple[str, bytes, datetime.datetime]]":
+        with self._lock:
+            return [
+                (key, content, modified)
+                for key, (content, modified) in sorted(self.objects.items())
+                if key.startswith(prefix)
+            ]
+
+
+class _S3Writer(io.BytesIO):
+    def __init__(self, path: "FakeS3Path", text: bool) -> None:
+        super().__init__()
+        self._path = path
+        self._text = text
+
+    def write(self, data):
+        return super().write(data.encode("utf-8") if self._text else data)
+
+    def close(self):
+        if not self.closed:
+            self._path.store.backend.call("s3.put")
+            self._path.store.put(self._path._full_key, self.getvalue())
+        super().close()
+
+
+class FakeS3Path:
+    store: FakeS3Store
+
+    def __init__(self, *parts: str) -> None:
+        self._path = "/" + "/".join(str(part).strip("/") for part in parts if str(part).strip("/") != "")
+
+    def __truediv__(self, other: str) -> "FakeS3Path":
+        return type(self)(self._path, other)
+
+    def __str__(self) -> str:
+        return self._path
+
+    def __repr__(self) -> str:
+        return f"S3Path('{self._path}')"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FakeS3Path) and other._path == self._path
+
+    def __hash__(self) -> int:
+        return hash(self._path)
+
+    @property
+    def bucket(self) -> str:
+        return self._path.split("/")[1]
+
+    @property
+    def key(self) -> str:
+        return "/".join(self._path.split("/")[2:])
+
+    @property
+    def name(self) -> str:
+        return self._path.split("/")[-1]
+
+    @property
+    def _full_key(self) -> str:
+        return self._path.lstrip("/")
+
+    def absolute(self) -> "FakeS3Path":
+        return self
+
+    def open(self, mode: str = "r"):
+        if "w" in mode:
+            return _S3Writer(self, "b" not in mode)
+        self.store.backend.call("s3.get")
+        content = self.store.get(self._full_key)
+        return io.BytesIO(content) if "b" in mode else io.StringIO(content.decode("utf-8"))
+
+    def is_dir(self) -> bool:
+        return len(self.store.list(self._full_key + "/")) > 0
+
+    def iterdir(self):
+        self.store.backend.call("s3.list")
+        prefix = self._full_key + "/"
+        children = []
+        for key, _, _ in self.store.list(prefix):
+            child = key[len(prefix) :].split("/")[0]
+            if child not in children:
+                children.append(child)
+        return [self / child for child in children]
+
+    def unlink(self, missing_ok: bool = False):
+        self.store.backend.call("s3.delete")
+        self.store.delete(self._full_key)
+
+    def rmdir(self):
+        pass
+
+
+class FakeObjectSummary:
+    def __init__(self, store: FakeS3Store, bucket: str, key: str, content: bytes, modified: datetime.datetime):
+        self._store = store
+        self.bucket_name = bucket
+        self.key = key
+        self.size = len(content)
+        self.e_tag = '"' + hashlib.md5(content).hexdigest() + '"'
+        self.last_modified = modified
+
+    def get(self) -> dict:
+        self._store.backend.call("s3.get")
+        return {"Body": io.BytesIO(self._store.get(f"{self.bucket_name}/{self.key}"))}
+
+
+class FakeObjectCollection:
+    def __init__(self, bucket: "FakeBucket") -> None:
+        self._bucket = bucket
+
+    def filter(self, Prefix: str = "") -> "list[FakeObjectSummary]":
+        store = self._bucket.store
+        objects = store.list(f"{self._bucket.name}/{Prefix}")
+        # One call per page of 1000 keys, like ListObjectsV2
+        for _ in range(max(1, -(-len(objects) // 1000))):
+            store.backend.call("s3.list")
+        return [
+            FakeObjectSummary(store, self._bucket.name, key[len(self._bucket.name) + 1 :], content, modified)
+            for key, content, modified in objects
+        ]
+
+
+class FakeBucket:
+    def __init__(self, store: FakeS3Store, name: str) -> None:
+        self.store = store
+        self.name = name
+        self.objects = FakeObjectCollection(self)
+
+    def delete_objects(self, Delete: dict) -> dict:
+        self.store.backend.call("s3.delete_objects")
+        for obj in Delete["Objects"][:1000]:
+            self.store.delete(f"{self.name}/{obj['Key']}")
+        return {} if Delete.get("Quiet") else {"Deleted": Delete["Objects"]}
+
+
+class FakeS3Resource:
+    def __init__(self, store: FakeS3Store) -> None:
+        self.store = store
+
+    def Bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(self.store, name)
+
+
+# ClearML
+
+
+class TaskStatusEnum(str, Enum):
+    created = "created"
+    queued = "queued"
+    in_progress = "in_progress"
+    stopped = "stopped"
+    published = "published"
+    publishing = "publishing"
+    closed = "closed"
+    failed = "failed"
+    completed = "completed"
+    unknown = "unknown"
+
+    def __str__(self) -> str:
+        return self.value
+
+
+class FakeClearML:
+    def __init__(self, backend: Backend) -> None:
+        self.backend = backend
+        self.tasks: dict[str, dict] = {}
+        self._lock = Lock()
+
+    def create_task(self, status: str = "queued", metrics: Optional["dict[str, float]"] = None) -> str:
+        task_id = self.backend.new_id("task")
+        last_metrics = {
+            "summary-hash": {
+                f"{name}-hash": {
+                    "metric": "Summary",
+                    "variant": name,
+                    "value": value,
+                    "min_value": value,
+                    "max_value": value,
+                }
+                for name, value in (metrics or {}).items()
+            }
+        }
+        with self._lock:
+            self.tasks[task_id] = {"id": task_id, "status": status, "last_metrics": last_metrics}
+        return task_id
+
+    def set_status(self, task_id: str, status: str):
+        with self._lock:
+            self.tasks[task_id]["status"] = status
+
+
+def make_task_class(clearml: FakeClearML) -> type:
+    class Task:
+        TaskStatusEnum = TaskStatusEnum
+
+        def __init__(self, data: dict) -> None:
+            self.id = data["id"]
+            self.data = types.SimpleNamespace(**data)
+
+        @classmethod
+        def query_tasks(cls, task_filter: Optional[dict] = None, additional_return_fields=None, **kwargs) -> list:
+            clearml.backend.call("clearml.query")
+            ids = (task_filter or {}).get("id", list(clearml.tasks.keys()))
+            fields = additional_return_fields or []
+            if len(fields) == 0:
+                return [task_id for task_id in ids if task_id in clearml.tasks]
+            return [
+                {"id": task_id, **{field: clearml.tasks[task_id].get(field) for field in fields}}
+                for task_id in ids
+                if task_id in clearml.tasks
+            ]
+
+        @classmethod
+        def get_tasks(cls, task_ids: Optional["list[str]"] = None, **kwargs) -> "list[Task]":
+            clearml.backend.call("clearml.get_tasks")
+            return [cls(clearml.tasks[task_id]) for task_id in (task_ids or []) if task_id in clearml.tasks]
+
+        @classmethod
+        def get_task(cls, task_id: str) -> "Optional[Task]":
+            clearml.backend.call("clearml.get_task")
+            return cls(clearml.tasks[task_id]) if task_id in clearml.tasks else None
+
+        def get_status(self) -> str:
+            clearml.backend.call("clearml.get_task")
+            return clearml.tasks[self.id]["status"]
+
+        def mark_stopped(self, force: bool = False, status_message: Optional[str] = None):
+            clearml.backend.call("clearml.stop")
+            clearml.set_status(self.id, "stopped")
+
+        def delete(self, **kwargs) -> bool:
+            clearml.backend.call("clearml.delete")
+            with clearml._lock:
+                clearml.tasks.pop(self.id, None)
+            return True
+
+    return Task
+
+
+class FakeTasksService:
+    """The tasks service of clearml's APIClient"""
+
+    def __init__(self, clearml: FakeClearML, bulk: bool = True) -> None:
+        self._clearml = clearml
+        self._bulk = bulk
+
+    def _apply(self, task_id: str, allowed: "list[str]", status: str) -> Optional[str]:
+        with self._clearml._lock:
+            task = self._clearml.tasks.get(task_id)
+            if task is None:
+                return f"Task {task_id} not found"
+            if task["status"] not in allowed:
+                return f"Invalid task status {task['status']}"
+            task["status"] = status
+        return None
+
+    def _many(self, operation: str, ids: "list[str]", allowed: "list[str]", status: str):
+        if not self._bulk:
+            raise ApiRequestError(404, f"Endpoint tasks.{operation} not found")
+        self._clearml.backend.call(f"clearml.{operation}")
+        results = {task_id: self._apply(task_id, allowed, status) for task_id in ids}
+        return types.SimpleNamespace(
+            succeeded=[{"id": task_id} for task_id, error in results.items() if error is None],
+            failed=[{"id": task_id, "error": error} for task_id, error in results.items() if error is not None],
+        )
+
+    def _one(self, operation: str, task_id: str, allowed: "list[str]", status: str):
+        self._clearml.backend.call(f"clearml.{operation}")
+        error = self._apply(task_id, allowed, status)
+        if error is not None:
+            raise RuntimeError(error)
+
+    def dequeue_many(self, ids: "list[str]", **kwargs):
+        return self._many("dequeue_many", ids, ["queued"], "created")
+
+    def stop_many(self, ids: "list[str]", force: bool = False, **kwargs):
+        return self._many("stop_many", ids, ["created", "queued", "in_progress"], "stopped")
+
+    def dequeue(self, task: str, **kwargs):
+        self._one("dequeue", task, ["queued"], "created")
+
+    def stop(self, task: str, force: bool = False, **kwargs):
+        self._one("stop", task, ["created", "queued", "in_progress"], "stopped")
+
+
+class FakeServices:
+    """All fake backends, sharing one call counter"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.backend = Backend(latency)
+        self.drive = FakeGoogleDrive(self.backend)
+        self.sheets = FakeGspreadClient(self.backend, self.drive)
+        self.s3 = FakeS3Store(self.backend)
+        self.clearml = FakeClearML(self.backend)
+        self.bulk_task_endpoints = True
+
+    def install_modules(self):
+        """Registers fake pydrive2.files, gspread_dataframe, s3path, boto3 and clearml modules. Must be called
+        before clowder's environment module imports them"""
+        FakeS3Path.store = self.s3
+        modules = {
+            "pydrive2": types.ModuleType("pydrive2"),
+            "pydrive2.files": types.ModuleType("pydrive2.files"),
+            "gspread_dataframe": types.ModuleType("gspread_dataframe"),
+            "s3path": types.ModuleType("s3path"),
+            "boto3": types.ModuleType("boto3"),
+            "clearml": types.ModuleType("clearml"),
+        }
+        modules["pydrive2.files"].ApiRequestError = ApiRequestError  # type: ignore
+        modules["pydrive2"].files = modules["pydrive2.files"]  # type: ignore
+        modules["gspread_dataframe"].set_with_dataframe = set_with_dataframe  # type: ignore
+        modules["s3path"].S3Path = FakeS3Path  # type: ignore
+        modules["boto3"].resource = lambda service, **kwargs: FakeS3Resource(self.s3)  # type: ignore
+        modules["clearml"].Task = make_task_class(self.clearml)  # type: ignore
+        for name in ["clearml.backend_api", "clearml.backend_api.session", "clearml.backend_api.session.client"]:
+            modules[name] = types.ModuleType(name)
+        modules["clearml.backend_api.session.client"].APIClient = lambda: types.SimpleNamespace(  # type: ignore
+            tasks=FakeTasksService(self.clearml, self.bulk_task_endpoints)
+        )
+        sys.modules.update(modules)
+
+    def install_clients(self, env):
+        """Points an Environment's Drive and Sheets clients at the fakes"""
+        env._drive = self.drive
+        env._gc = self.sheets
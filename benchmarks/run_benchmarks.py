@@ -0,0 +1,192 @@
+"""Offline benchmark of clowder's investigation lifecycle. Runs setup, start_investigation, cancel, sync,
+_generate_results and delete against the in-process fakes in fakes.py for investigations of increasing size and
+reports the wall time and number of remote API calls of each phase. Cancel runs twice, against a ClearML server with
+the bulk task endpoints and against one without them.
+
+    python benchmarks/run_benchmarks.py --sizes 10 100 1000 --latency 0.01 --json results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from time import perf_counter
+
+from fakes import FakeServices
+
+CLOWDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clowder")
+PHASES = ["setup", "start_investigation", "cancel", "cancel_per_task", "sync", "generate_results", "delete"]
+CONFIG_TEMPLATE = """data:
+  corpus_pairs:
+  - type: train,val,test
+    src: {{ src }}
+    trg: {{ trg }}
+params:
+  learning_rate: {{ lr }}
+"""
+SCORES_CSV = """scorer,score
+BLEU,{bleu}/55.1/30.2/20.3/10.4 (BP = 1.000 ratio = 1.000 hyp_len = 100 ref_len = 100)
+CHRF3,{chrf}
+WER,60.2
+TER,55.3
+spBLEU,25.6
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Experiments per investigation")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds added to every fake API call")
+    parser.add_argument("--max-workers", type=int, default=None, help="Worker threads (default: clowder's default)")
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="Keep clowder's Drive and Sheets rate limits (off by default)"
+    )
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show clowder's own output and progress bars")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    services = FakeServices(args.latency)
+    services.install_modules()
+    # clowder keeps its local state in ../.clowder relative to the working directory
+    work_dir = os.path.join(tempfile.mkdtemp(prefix="clowder-bench-"), "work")
+    os.makedirs(work_dir)
+    os.chdir(work_dir)
+    sys.path.insert(0, CLOWDER_DIR)
+    import environment
+    import quota
+
+    services.install_clients(environment.ENV)
+    environment.Investigation._submit_experiment = lambda investigation, row: submit_experiment(services, row)
+    if not args.rate_limits:
+        for api in list(quota.RATE_LIMITS):
+            quota.configure(api, 1e9, 10**9)
+    max_workers = args.max_workers if args.max_workers is not None else environment.DEFAULT_MAX_WORKERS
+
+    results = {}
+    for size in args.sizes:
+        results[size] = run_lifecycle(services, environment, size, max_workers, args.verbose)
+        print_report(size, results[size])
+    if args.json_path is not None:
+        with open(args.json_path, "w") as f:
+            json.dump(
+                {
+                    "latency": args.latency,
+                    "max_workers": max_workers,
+                    "rate_limits": args.rate_limits,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+def submit_experiment(services: FakeServices, row) -> str:
+    services.backend.call("clearml.submit")
+    return services.clearml.create_task(
+        "completed", {"BLEU": round(random.uniform(10, 40), 2), "CHRF3": round(random.uniform(30, 60), 2)}
+    )
+
+
+def run_lifecycle(services: FakeServices, environment, size: int, max_workers: int, verbose: bool) -> dict:
+    ENV = environment.ENV
+    ENV.listing_cache.clear()
+    ENV._clearml_tasks.clear()
+    ENV._clearml_task_data.clear()
+    name = f"bench-{size}"
+    with quiet(verbose):
+        investigation = ENV.create_investigation(name)
+    seed_investigation(services, investigation, size)
+
+    def refreshed():
+        # Each clowder command loads the investigation from the meta afresh
+        return ENV.get_investigation(name)
+
+    steps = {
+        "setup": lambda: refreshed().setup(max_workers),
+        "start_investigation": lambda: refreshed().start_investigation(max_workers=max_workers),
+        "cancel": lambda: refreshed().cancel(max_workers),
+        "cancel_per_task": lambda: refreshed().cancel(max_workers),
+        "sync": lambda: refreshed().sync(gather_results=False),
+        "generate_results": lambda: refreshed()._generate_results(max_workers),
+        "delete": lambda: refreshed().delete(),
+    }
+    phases = {}
+    for phase in PHASES:
+        if phase in ["cancel", "cancel_per_task"]:
+            seed_task_statuses(services, environment, name, ["queued", "in_progress"])
+            services.bulk_task_endpoints = phase == "cancel"
+        if phase == "sync":
+            seed_task_statuses(services, environment, name, ["completed"])
+            seed_results(services, investigation, size)
+        before = Counter(services.backend.calls)
+        start = perf_counter()
+        with quiet(verbose):
+            steps[phase]()
+        seconds = perf_counter() - start
+        calls = dict(sorted((Counter(services.backend.calls) - before).items()))
+        phases[phase] = {"seconds": round(seconds, 3), "total_calls": sum(calls.values()), "calls": calls}
+    return phases
+
+
+def seed_investigation(services: FakeServices, investigation, size: int):
+    """Fills in the ExperimentsSetup sheet and config template as a user would, without counting API calls"""
+    services.drive.write_file(investigation.id, "config.yml", CONFIG_TEMPLATE)
+    spreadsheet = services.sheets._spreadsheets[investigation.sheet_id]
+    spreadsheet.sheet1.records = [
+        {
+            "name": f"exp-{i}",
+            "entrypoint": "silnlp.nmt.experiment",
+            "results-csvs": "scores-1000.csv",
+            "results-clearml-metrics": "BLEU;CHRF3",
+            "src": "en-bible",
+            "trg": f"lang{i % 50}-bible",
+            "lr": [0.0001, 0.0002, 0.0005][i % 3],
+        }
+        for i in range(size)
+    ]
+    services.drive.touch(investigation.sheet_id)
+
+
+def seed_task_statuses(services: FakeServices, environment, name: str, statuses: "list[str]"):
+    """Sets the ClearML status of the investigation's tasks, cycling through `statuses`, without counting API calls"""
+    for i, clearml_id in enumerate(environment.ENV._clearml_ids(name).values()):
+        services.clearml.set_status(clearml_id, statuses[i % len(statuses)])
+
+
+def seed_results(services: FakeServices, investigation, size: int):
+    """Writes the outputs silnlp would leave in S3 once every experiment has finished"""
+    prefix = str(investigation.investigation_s3_path).lstrip("/")
+    for i in range(size):
+        services.s3.put(
+            f"{prefix}/exp-{i}/scores-1000.csv",
+            SCORES_CSV.format(bleu=round(random.uniform(10, 40), 2), chrf=round(random.uniform(30, 60), 2)).encode(),
+        )
+
+
+@contextlib.contextmanager
+def quiet(verbose: bool):
+    if verbose:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def print_report(size: int, phases: dict):
+    print(f"\n{size} experiments")
+    print(f"{'phase':<20} {'seconds':>9} {'calls':>7}  breakdown")
+    for phase, result in phases.items():
+        breakdown = ", ".join(f"{operation}={count}" for operation, count in result["calls"].items())
+        print(f"{phase:<20} {result['seconds']:>9.3f} {result['total_calls']:>7}  {breakdown}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,47 @@
+from __future__ import annotations
+
 import warnings
 
 warnings.filterwarnings("ignore", r"Blowfish")
 
+import io
 import os
+import atexit
 import datetime
-from typing import Any, Optional, Union
-from pathlib import Path
-import gspread
-from clearml import Task
-import s3path
-from oauth2client.service_account import ServiceAccountCredentials
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive, GoogleDriveFile
-from pydrive2.files import MediaIoReadable
-from io import StringIO
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, Union
 from pathlib import Path
 import subprocess
-import pandas as pd
+from concurrent.futures import as_completed
+from collections import Counter, OrderedDict
+from threading import Lock, RLock
+from contextlib import contextmanager
+import tempfile
+from time import monotonic, time
 import re
-import jinja2
-from clearml import Task
+import json
+import hashlib
 import yaml
-import numpy as np
-from gspread import Worksheet
-import gspread_dataframe as gd
 from status import Status
-from time import sleep
-from tqdm import tqdm
+import quota
+from quota import throttled
+import tracing
+from tracing import ThreadPoolExecutor, traced
+from results_cache import ResultsCache
+from sheet_cache import SheetCache
+import sweeps
+from investigation_log import InvestigationLog
+from journal import OperationJournal
+
+# Google, ClearML, S3 and the data libraries are slow to import, so they are only imported by the code paths that
+# use them. Commands that only read the local meta never load them
+if TYPE_CHECKING:
+    import gspread
+    import jinja2
+    import pandas as pd
+    import s3path
+    from clearml import Task
+    from pydrive2.drive import GoogleDrive, GoogleDriveFile
+    from pydrive2.files import MediaIoReadable
 
 GDRIVE_SCOPE = "https://www.googleapis.com/auth/drive"
 CLEARML_QUEUE = "jobs_backlog"
@@ -35,6 +50,21 @@ RESULTS_CSVS_ATTRIBUTE = "results-csvs"
 RESULTS_CLEARML_METRIC_ATTRIBUTE = "results-clearml-metrics"
 ENTRYPOINT_ATTRIBUTE = "entrypoint"
 NAME_ATTRIBUTE = "name"
+DEFAULT_MAX_WORKERS = 8
+GDRIVE_CHUNK_SIZE = 8 * 1024 * 1024
+SYNC_MANIFEST_FILENAME = "clowder.sync.yml"
+GDRIVE_LISTING_TTL = 300
+# Sweeps reach thousands of experiment folders and setup and results both visit every one of them. Experiment
+# folders only hold a few files, so each cached listing is small
+GDRIVE_LISTING_MAX_ENTRIES = 10000
+GDRIVE_PARENTS_PER_QUERY = 40
+CLEARML_TASKS_PER_QUERY = 500
+S3_DELETE_BATCH_SIZE = 1000
+
+
+def _field(obj: Any, name: str) -> Any:
+    """Reads `name` from a ClearML API response, which may be a dict or a data model object"""
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
 
 
 class MissingConfigurationFile(IOError):
@@ -67,7 +97,12 @@ class Investigation:
         self.sheet_id = sheet_id
         self.log_id = log_id
         self._status: Status = Status(status)
-        self.investigation_s3_path = s3path.S3Path(ENV.EXPERIMENTS_S3_FOLDER) / (self.name + "_" + self.id)
+
+    @property
+    def investigation_s3_path(self) -> s3path.S3Path:
+        import s3path
+
+        return s3path.S3Path(ENV.EXPERIMENTS_S3_FOLDER) / (self.name + "_" + self.id)
 
     @property
     def status(self):
@@ -83,9 +118,13 @@ class Investigation:
     def experiments(self):
         return ENV.current_meta["investigations"][self.name]["experiments"]
 
+    @property
+    def synced_at(self) -> float:
+        """Unix time of the last sync with remote services, or 0 if the investigation has never been synced"""
+        return ENV.current_meta["investigations"][self.name].get("synced_at", 0)
+
     def _get_experiments_df(self):
-        worksheet: gspread.Spreadsheet = ENV.gc.open_by_key(self.sheet_id)
-        experiments_df: pd.DataFrame = pd.DataFrame(worksheet.sheet1.get_all_records())
+        experiments_df: pd.DataFrame = ENV._read_experiments_setup(self.sheet_id)
         if NAME_ATTRIBUTE not in experiments_df.columns:
             raise MissingConfigurationFile("Missing name column in ExperimentsSetup sheet")
         if ENTRYPOINT_ATTRIBUTE not in experiments_df.columns:
@@ -97,35 +136,139 @@ class Investigation:
             )
         return experiments_df
 
-    def setup(self):
-        experiments_df = self._get_experiments_df()
+    def _experiments(self) -> Iterator[pd.Series]:
+        """Yields one row per experiment, expanding each sweep row of the ExperimentsSetup sheet into an
+        experiment per combination of its list and range values"""
+        import pandas as pd
+
+        names = set()
+        for _, row in self._get_experiments_df().iterrows():
+            try:
+                expanded = sweeps.expand(
+                    row.to_dict(),
+                    NAME_ATTRIBUTE,
+                    [ENTRYPOINT_ATTRIBUTE, RESULTS_CSVS_ATTRIBUTE, RESULTS_CLEARML_METRIC_ATTRIBUTE],
+                )
+            except sweeps.EmptySweepError as e:
+                raise MissingConfigurationFile(
+                    f"Sweep in column {e.column} of experiment {row[NAME_ATTRIBUTE]} has no values"
+                ) from e
+            for params in expanded:
+                name = str(params[NAME_ATTRIBUTE])
+                if name in names:
+                    raise MissingConfigurationFile(
+                        f"Duplicate experiment name {name} after expanding sweeps. Each name needs to be unique."
+                    )
+                names.add(name)
+                yield pd.Series(params, name=name)
+
+    @tracing.scoped
+    def setup(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        from tqdm import tqdm
+
+        journal = OperationJournal(self.id, "setup")
         self.experiments_folder_id = ENV._create_gdrive_folder("experiments", self.id)
         ENV.current_meta["investigations"][self.name]["experiments_folder_id"] = self.experiments_folder_id
         ENV.meta.flush()
-        for name, params in experiments_df.iterrows():
-            experiment_folder_id = ENV._create_gdrive_folder(str(name), self.experiments_folder_id)
-            self._setup_experiment(params, experiment_folder_id)
-        ENV._copy_gdrive_folder_to_s3(self.experiments_folder_id, self.investigation_s3_path)
+        template_source, template = self._get_config_template()
+        rendered_configs = {}
+        config_hashes = {}
+        for params in self._experiments():
+            name = params.name
+            rendered_configs[str(name)] = template.render(params.to_dict())
+            config_hashes[str(name)] = self._config_hash(template_source, params, rendered_configs[str(name)])
+        experiment_folders = ENV._dict_of_gdrive_files(self.experiments_folder_id)
+        setup_hashes = ENV.current_meta["investigations"][self.name].setdefault("setup_hashes", {})
+        changed_configs = {
+            name: rendered_config
+            for name, rendered_config in rendered_configs.items()
+            if setup_hashes.get(name) != config_hashes[name] or name not in experiment_folders
+        }
+        if len(changed_configs) == 0:
+            journal.clear()
+            return
+        print(f"Setting up {len(changed_configs)} of {len(rendered_configs)} experiments")
+        # Configs uploaded by an interrupted setup are not uploaded again, and those also copied to S3 not copied
+        folder_ids = {}
+        for name in changed_configs:
+            uploaded = journal.get(f"uploaded/{name}")
+            if uploaded is not None and uploaded["hash"] == config_hashes[name]:
+                folder_ids[name] = uploaded["folder_id"]
+        to_upload = {name: config for name, config in changed_configs.items() if name not in folder_ids}
+        # List every existing experiment folder up front so the uploads below only hit the listing cache
+        ENV._dict_of_gdrive_files_in_folders(
+            [file["id"] for name, file in experiment_folders.items() if name in to_upload], max_workers
+        )
+        failed: dict[str, Exception] = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._setup_experiment, name, rendered_config): name
+                for name, rendered_config in to_upload.items()
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                name = futures[future]
+                try:
+                    folder_ids[name] = future.result()
+                except Exception as e:
+                    failed[name] = e
+                    continue
+                journal.record(f"uploaded/{name}", {"hash": config_hashes[name], "folder_id": folder_ids[name]})
+        for name, e in failed.items():
+            print(f"Failed to set up experiment {name}: {e}")
+        if len(failed) > 0:
+            raise next(iter(failed.values()))
+        to_copy = [name for name in folder_ids if journal.get(f"copied/{name}") != config_hashes[name]]
+        ENV._copy_gdrive_folders_to_s3(
+            [(folder_ids[name], self.investigation_s3_path / name) for name in to_copy],
+            max_workers,
+            on_copied=lambda index: journal.record(f"copied/{to_copy[index]}", config_hashes[to_copy[index]]),
+        )
+        for name in changed_configs:
+            setup_hashes[name] = config_hashes[name]
+        ENV.meta.flush()
+        journal.clear()
+
+    def _get_config_template(self) -> "tuple[str, jinja2.Template]":
+        import jinja2
 
-    def _setup_experiment(self, params: pd.Series, folder_id: str):
         files = ENV._dict_of_gdrive_files(self.id)
-        # print(params, folder_id)
         silnlp_config_yml = ENV._read_gdrive_file_as_string(files["config.yml"]["id"])  # TODO save config? Per type?
-        rtemplate = jinja2.Environment(loader=jinja2.BaseLoader()).from_string(silnlp_config_yml)
-        rendered_config = rtemplate.render(params.to_dict())
-        # print(rendered_config)
+        return silnlp_config_yml, jinja2.Environment(loader=jinja2.BaseLoader()).from_string(silnlp_config_yml)
+
+    def _config_hash(self, template_source: str, params: pd.Series, rendered_config: str) -> str:
+        content = json.dumps(
+            {"template": template_source, "params": params.to_dict(), "config": rendered_config},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _setup_experiment(self, name: str, rendered_config: str) -> str:
+        folder_id = ENV._create_gdrive_folder(name, self.experiments_folder_id)
         ENV._write_gdrive_file_in_folder(folder_id, "config.yml", rendered_config)
+        return folder_id
 
-    def start_investigation(self, force_rerun: bool = False) -> bool:
-        experiments_df: pd.DataFrame = self._get_experiments_df()
-        now_running = False
+    @tracing.scoped
+    def start_investigation(self, force_rerun: bool = False, max_workers: int = DEFAULT_MAX_WORKERS) -> bool:
+        from clearml import Task
+
+        journal = OperationJournal(self.id, "start_investigation")
+        if force_rerun:
+            # Experiments submitted by an interrupted run are submitted again like all the others
+            journal.clear()
         temp_meta = {}
-        for _, row in experiments_df.iterrows():
+        to_submit = []
+        for row in self._experiments():
             if row[NAME_ATTRIBUTE] not in ENV.current_meta["investigations"][self.name]["experiments"]:
                 ENV.current_meta["investigations"][self.name]["experiments"][row[NAME_ATTRIBUTE]] = {}
             temp_meta[row[NAME_ATTRIBUTE]] = ENV.current_meta["investigations"][self.name]["experiments"][
                 row[NAME_ATTRIBUTE]
             ]
+            clearml_id = journal.get(f"submitted/{row[NAME_ATTRIBUTE]}")
+            if clearml_id is not None:
+                # Submitted by an interrupted run
+                temp_meta[row[NAME_ATTRIBUTE]]["clearml_id"] = clearml_id
+                continue
             if (
                 not force_rerun
                 and ENV.current_meta["investigations"][self.name]["experiments"][row[NAME_ATTRIBUTE]].get("status")
@@ -137,26 +280,69 @@ class Investigation:
                 Task.TaskStatusEnum.queued,
             ]:
                 continue
-            experiment_path: s3path.S3Path = self.investigation_s3_path / row[NAME_ATTRIBUTE]
-            command = f"python -m {row['entrypoint']} --memory-growth --clearml-queue {CLEARML_QUEUE} {'/'.join(str(experiment_path.absolute()).split('/')[4:])}"
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
-            )
-            print(result.stdout)
-            now_running = True
-            match = re.search(r"new task id=(.*)", result.stdout)
-            clearml_id = match.group(1) if match is not None else "unknown"
-            temp_meta[row[NAME_ATTRIBUTE]]["clearml_id"] = clearml_id
+            to_submit.append(row)
         ENV.current_meta["investigations"][self.name]["experiments"] = temp_meta
         ENV.meta.flush()
-        return now_running
+        submitted = self._submit_experiments(to_submit, max_workers, journal)
+        if len(submitted) == len(to_submit):
+            journal.clear()
+        return len(submitted) > 0
+
+    def _submit_experiments(
+        self, rows: "list[pd.Series]", max_workers: int, journal: Optional[OperationJournal] = None
+    ) -> "dict[str, str]":
+        """Submits experiments to ClearML with at most `max_workers` concurrent submissions, recording each
+        task id in `journal` as soon as it is known and in the meta once all are submitted. Returns a mapping of
+        experiment name to ClearML task id"""
+        from tqdm import tqdm
+
+        submitted: dict[str, str] = {}
+        failed: dict[str, Exception] = {}
+        if len(rows) == 0:
+            return submitted
+        experiments = ENV.current_meta["investigations"][self.name]["experiments"]
+        with ENV.meta.transaction(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._submit_experiment, row): row[NAME_ATTRIBUTE] for row in rows}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                name = futures[future]
+                try:
+                    clearml_id = future.result()
+                except Exception as e:
+                    failed[name] = e
+                    continue
+                submitted[name] = clearml_id
+                # An experiment whose task id could not be read from the output is submitted again by the next run
+                if journal is not None and clearml_id != "unknown":
+                    journal.record(f"submitted/{name}", clearml_id)
+                experiments[name]["clearml_id"] = clearml_id
+            # Marks the meta dirty so that the transaction writes every task id at once on exit
+            ENV.meta.flush()
+        for name, e in failed.items():
+            print(f"Failed to submit experiment {name}: {e}")
+        return submitted
+
+    @traced("clearml.submit")
+    def _submit_experiment(self, row: pd.Series) -> str:
+        experiment_path: s3path.S3Path = self.investigation_s3_path / row[NAME_ATTRIBUTE]
+        command = f"python -m {row['entrypoint']} --memory-growth --clearml-queue {CLEARML_QUEUE} {'/'.join(str(experiment_path.absolute()).split('/')[4:])}"
+        result = subprocess.run(
+            command,
+            shell=True,
+            capture_output=True,
+            text=True,
+        )
+        print(result.stdout)
+        match = re.search(r"new task id=(.*)", result.stdout)
+        return match.group(1) if match is not None else "unknown"
 
+    @tracing.scoped
     def sync(self, gather_results=True):
+        with ENV.meta.transaction():
+            return self._sync(gather_results)
+
+    def _sync(self, gather_results=True):
         # Fetch info from clearml
-        clearml_tasks_dict: dict[str, Union[Task, None]] = ENV._get_clearml_tasks(self.name)
+        clearml_tasks_dict: "dict[str, Optional[dict]]" = ENV._get_clearml_task_data(self.name, refresh=True)
         # Update gdrive, fetch
         meta_folder_id = ENV.current_meta["investigations"][self.name]["clowder_meta_yml_id"]
         remote_meta_content = yaml.safe_load(ENV._read_gdrive_file_as_string(meta_folder_id))
@@ -168,11 +354,11 @@ class Investigation:
                     continue
                 if name not in remote_meta_content["experiments"]:
                     remote_meta_content["experiments"][name] = {}
-                remote_meta_content["experiments"][name]["clearml_id"] = task.id
+                remote_meta_content["experiments"][name]["clearml_id"] = task["id"]
                 remote_meta_content["experiments"][name][
                     "clearml_task_url"
-                ] = f"https://{CLEARML_URL}/projects/*/experiments/{task.id}/output/execution"
-                remote_meta_content["experiments"][name]["status"] = task.get_status()
+                ] = f"https://{CLEARML_URL}/projects/*/experiments/{task['id']}/output/execution"
+                remote_meta_content["experiments"][name]["status"] = task["status"]
         ENV._write_gdrive_file_in_folder(
             self.id, "clowder.meta.yml", yaml.safe_dump(remote_meta_content), "application/x-yaml"
         )
@@ -192,6 +378,7 @@ class Investigation:
                 "experiments"
             ][exp]["status"]
             statuses.append(remote_meta_content["experiments"][exp]["status"])
+        ENV.current_meta["investigations"][self.name]["synced_at"] = time()
         ENV.meta.flush()
         self.status = Status.from_clearml_task_statuses(statuses, self.status)  # type: ignore
         if self.status == Status.Completed:
@@ -203,49 +390,84 @@ class Investigation:
                 print("In order to see results, rerun with gather_results set to True.")
         return True
 
-    def _generate_results(self):
+    @tracing.scoped
+    def _generate_results(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        import gspread_dataframe as gd
+        import numpy as np
+        import pandas as pd
+        from tqdm import tqdm
+
+        journal = OperationJournal(self.id, "generate_results")
         spreadsheet = ENV.gc.open_by_key(self.sheet_id)
-        worksheets = spreadsheet.worksheets()
-        setup_sheet: Worksheet = list(filter(lambda s: s.title == "ExperimentsSetup", worksheets))[0]
-        setup_df = pd.DataFrame(setup_sheet.get_all_records())
-        results: dict[str, pd.DataFrame] = {}
+        experiments = list(self._experiments())
         experiment_folders = ENV._dict_of_gdrive_files(self.experiments_folder_id)
+        manifest = self._read_sync_manifest()
+        # Files copied by an interrupted run are in its journal but not in the uploaded manifest
+        for step, entries in journal.steps.items():
+            if step.startswith("copied/"):
+                manifest["objects"].update(entries["objects"])
+                manifest["folders"].update(entries["folders"])
+        # One listing of the investigation's prefix serves both the copy to Drive and the aggregation
+        objects = ENV._list_s3_objects(self.investigation_s3_path)
+        investigation_prefix = self.investigation_s3_path.key.rstrip("/") + "/"
+        objects_by_experiment: dict[str, list] = {}
+        for obj in objects:
+            experiment_name = obj.key[len(investigation_prefix) :].partition("/")[0]
+            objects_by_experiment.setdefault(experiment_name, []).append(obj)
         print("Copying over results...")
-        for _, row in tqdm(setup_df.iterrows()):
+        for row in tqdm(experiments):
+            s3_path = self.investigation_s3_path / row[NAME_ATTRIBUTE]
             ENV._copy_s3_folder_to_gdrive(
-                self.investigation_s3_path / row[NAME_ATTRIBUTE], experiment_folders[row[NAME_ATTRIBUTE]]["id"]
+                s3_path,
+                experiment_folders[row[NAME_ATTRIBUTE]]["id"],
+                manifest,
+                objects_by_experiment.get(row[NAME_ATTRIBUTE], []),
             )
-            for name in row[RESULTS_CSVS_ATTRIBUTE].split(";"):
-                name = name.strip()
-                s3_filepath: s3path.S3Path = (
-                    self.investigation_s3_path / row[NAME_ATTRIBUTE] / name
-                )  # TODO - use result that's already been copied over to gdrive
-                with s3_filepath.open() as f:
-                    df = pd.read_csv(StringIO(f.read()))
-                    if "scores" in name:
-                        name = "scores"
-                        df = self._process_scores_csv(df)
-                    df.insert(0, NAME_ATTRIBUTE, [row[NAME_ATTRIBUTE]])
-                    if name not in results:
-                        results[name] = pd.DataFrame()
-                    results[name] = pd.concat([results[name], df], join="outer", ignore_index=True)
-
-        tasks = ENV._get_clearml_tasks(self.name)
+            prefix = s3_path.key.rstrip("/") + "/"
+            journal.record(
+                f"copied/{row[NAME_ATTRIBUTE]}",
+                {
+                    "objects": {key: entry for key, entry in manifest["objects"].items() if key.startswith(prefix)},
+                    "folders": {key: entry for key, entry in manifest["folders"].items() if key.startswith(prefix)},
+                },
+            )
+        self._write_sync_manifest(manifest)
+        print("Aggregating results...")
+        cache = ResultsCache(self.id)
+        results = self._aggregate_results_csvs(experiments, cache, max_workers, objects)
+
+        # Metrics of completed tasks no longer change, so only those missing from the cache are fetched
+        tasks = ENV._get_clearml_task_data(self.name)
+        task_metrics: dict[str, dict] = {}
+        for experiment_name, task in tasks.items():
+            if task is not None and task["status"] == "completed":
+                cached = cache.get_metrics(experiment_name, task["id"])
+                if cached is not None:
+                    task_metrics[experiment_name] = cached
+        fetched = ENV._get_clearml_task_metrics(
+            [task["id"] for name, task in tasks.items() if task is not None and name not in task_metrics]
+        )
+        for experiment_name, task in tasks.items():
+            if task is None or experiment_name in task_metrics:
+                continue
+            task_metrics[experiment_name] = fetched.get(task["id"], {})
+            if task["status"] == "completed":
+                cache.put_metrics(experiment_name, task["id"], task_metrics[experiment_name])
+        cache.flush()
         metrics_data = {}
         metrics_names = set()
-        for _, row in setup_df.iterrows():
+        for row in experiments:
             cur_metrics_names = set(map(lambda x: x.strip(), row[RESULTS_CLEARML_METRIC_ATTRIBUTE].split(";")))
             metrics_names = metrics_names.union(cur_metrics_names)
 
         metrics_names_list = list(metrics_names)
         if len(metrics_names_list) > 0 and metrics_names_list[0] != "":
-            for index, row in setup_df.iterrows():
-                task = tasks[row[NAME_ATTRIBUTE]]
-                if task is None:
+            for index, row in enumerate(experiments):
+                if tasks.get(row[NAME_ATTRIBUTE]) is None:
                     continue
                 cols = [row[NAME_ATTRIBUTE]]
+                metrics = task_metrics[row[NAME_ATTRIBUTE]].get("Summary", {})
                 for metric in metrics_names_list:
-                    metrics = task.get_last_scalar_metrics()["Summary"]
                     cols.append(metrics.get(metric, {"last": np.nan})["last"])
                     metrics_data[index] = cols
             metrics_df = pd.DataFrame.from_dict(
@@ -255,32 +477,94 @@ class Investigation:
 
         print("Processing results data...")
         for name, df in tqdm(results.items()):
+            # Sheets written by an interrupted run are only written again if their data has changed since
+            digest = hashlib.sha256(df.to_csv(index=False).encode("utf-8")).hexdigest()
+            if journal.get(f"sheet/{name}") == digest:
+                continue
             for w in spreadsheet.worksheets():
                 if w.title == name:
                     spreadsheet.del_worksheet(w)
             s = spreadsheet.add_worksheet(name, rows=0, cols=0)
             gd.set_with_dataframe(s, df)
-            min_max_df = self._min_and_max_per_col(df)
-            for row_index, row in df.iterrows():
-                col_index = 0
-                for col in df.columns:
-                    if not np.issubdtype(df.dtypes[col], np.number):
-                        col_index += 1
-                        continue
-                    ref = s.cell(
-                        row_index + 2, col_index + 1  # type: ignore
-                    ).address  # +2 = 1 + 1 - 1 for zero- vs. one-indexed and 1 to skip column names
-                    col: str
-                    max = min_max_df.at[col, "max"]
-                    min = min_max_df.at[col, "min"]
-                    range = max - min
-                    r, g, b = self._color_func((row[col] - min) / (range) if range != 0 else 1.0)
-                    s.format(f"{ref}", {"backgroundColor": {"red": r, "green": g, "blue": b}})
-
-                    col_index += 1
-                    sleep(1)  # TODO avoids exceeded per minute read quota - find better solution
+            requests = self._heatmap_format_requests(df, s.id)
+            if len(requests) > 0:
+                spreadsheet.batch_update({"requests": requests})
+            journal.record(f"sheet/{name}", digest)
+        journal.clear()
+
+    def _aggregate_results_csvs(
+        self,
+        experiments: "list[pd.Series]",
+        cache: ResultsCache,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        objects: Optional[list] = None,
+    ) -> "dict[str, pd.DataFrame]":
+        """Reads every experiment's results csvs concurrently and concatenates each result's frames once. Csvs whose
+        S3 ETag matches the local results cache are not downloaded. `objects` is a listing of the investigation's
+        S3 prefix, which is listed again if not given"""
+        import pandas as pd
+
+        if objects is None:
+            objects = ENV._list_s3_objects(self.investigation_s3_path)
+        etags = {obj.key: obj.e_tag for obj in objects}
+        csvs = [
+            (row[NAME_ATTRIBUTE], name.strip())
+            for row in experiments
+            for name in row[RESULTS_CSVS_ATTRIBUTE].split(";")
+            if name.strip() != ""
+        ]
+        frames: dict[str, list[pd.DataFrame]] = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for name, df in executor.map(lambda csv: self._read_results_csv(*csv, cache, etags), csvs):
+                frames.setdefault(name, []).append(df)
+        cache.flush()
+        return {name: pd.concat(dfs, join="outer", ignore_index=True) for name, dfs in frames.items()}
+
+    def _read_results_csv(
+        self, experiment_name: str, csv_name: str, cache: ResultsCache, etags: "dict[str, str]"
+    ) -> "tuple[str, pd.DataFrame]":
+        import pandas as pd
+
+        s3_filepath: s3path.S3Path = (
+            self.investigation_s3_path / experiment_name / csv_name
+        )  # TODO - use result that's already been copied over to gdrive
+        etag = etags.get(s3_filepath.key)
+        if etag is not None:
+            cached = cache.get_csv(experiment_name, csv_name, etag)
+            if cached is not None:
+                return cached
+        with tracing.span("s3.read"), s3_filepath.open("rb") as f:
+            content = f.read()
+            tracing.add_bytes(len(content))
+        df = pd.read_csv(io.BytesIO(content))
+        name = csv_name
+        if "scores" in name:
+            name = "scores"
+            df = self._process_scores_csv(df)
+        df.insert(0, NAME_ATTRIBUTE, [experiment_name])
+        if etag is not None:
+            cache.put_csv(experiment_name, csv_name, etag, name, df)
+        return name, df
+
+    def _read_sync_manifest(self) -> dict:
+        files = ENV._dict_of_gdrive_files(self.id)
+        if SYNC_MANIFEST_FILENAME not in files:
+            return {"objects": {}, "folders": {}}
+        manifest = yaml.safe_load(ENV._read_gdrive_file_as_string(files[SYNC_MANIFEST_FILENAME]["id"]))
+        if manifest is None:
+            manifest = {}
+        manifest.setdefault("objects", {})
+        manifest.setdefault("folders", {})
+        return manifest
+
+    def _write_sync_manifest(self, manifest: dict):
+        ENV._write_gdrive_file_in_folder(
+            self.id, SYNC_MANIFEST_FILENAME, yaml.safe_dump(manifest), "application/x-yaml"
+        )
 
     def _process_scores_csv(self, df: pd.DataFrame) -> pd.DataFrame:
+        import pandas as pd
+
         ret = df[["score"]]
         column_names = df[["scorer"]].values.flatten()
         ret = ret.transpose()
@@ -293,6 +577,8 @@ class Investigation:
         return ret
 
     def _min_and_max_per_col(self, df: pd.DataFrame):
+        import pandas as pd
+
         df = df.select_dtypes(include="number")
         ret = {}
         col: str
@@ -300,42 +586,119 @@ class Investigation:
             ret[col] = [df[col].max(), df[col].min()]
         return pd.DataFrame.from_dict(ret, orient="index", columns=["max", "min"])
 
+    def _heatmap_format_requests(self, df: pd.DataFrame, sheet_id: int) -> "list[dict]":
+        """Builds one updateCells request per numeric column coloring each cell by its position in the column's range"""
+        import numpy as np
+        import pandas as pd
+
+        min_max_df = self._min_and_max_per_col(df)
+        requests = []
+        for col_index, col in enumerate(df.columns):
+            if not np.issubdtype(df.dtypes[col], np.number):
+                continue
+            max = min_max_df.at[col, "max"]
+            min = min_max_df.at[col, "min"]
+            range = max - min
+            rows = []
+            for value in df[col]:
+                if pd.isna(value):
+                    rows.append({"values": [{}]})
+                    continue
+                r, g, b = self._color_func((value - min) / (range) if range != 0 else 1.0)
+                rows.append({"values": [{"userEnteredFormat": {"backgroundColor": {"red": r, "green": g, "blue": b}}}]})
+            requests.append(
+                {
+                    "updateCells": {
+                        "rows": rows,
+                        "fields": "userEnteredFormat.backgroundColor",
+                        "start": {
+                            "sheetId": sheet_id,
+                            "rowIndex": 1,  # skip column names
+                            "columnIndex": col_index,
+                        },
+                    }
+                }
+            )
+        return requests
+
     def _color_func(self, x: float) -> tuple:
         if x > 0.5:
             return ((209 - (209 - 27) * (x - 0.5) / 0.5) / 255, 209 / 255, 27 / 255)
         return (209 / 255, (27 + (209 - 27) * x / 0.5) / 255, 27 / 255)
 
-    def cancel(self):
-        for _, obj in ENV.current_meta["investigations"][self.name]["experiments"].items():
-            task: Optional[Task] = Task.get_task(task_id=obj["clearml_id"])
-            if task is not None:
-                task.mark_stopped(status_message="Task was stopped by user")
+    @tracing.scoped
+    def cancel(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        """Dequeues the queued tasks of the investigation and stops its running ones, then records the status of
+        every experiment in the meta with a single write"""
+        ids = ENV._clearml_ids(self.name)
+        statuses, failed = ENV._cancel_clearml_tasks(list(ids.values()), max_workers)
+        with ENV.meta.transaction():
+            experiments = self.experiments
+            for name, clearml_id in ids.items():
+                if clearml_id in statuses:
+                    experiments[name]["status"] = statuses[clearml_id]
+            ENV.meta.flush()
+            self.status = Status.from_clearml_task_statuses(  # type: ignore
+                [experiment["status"] for experiment in experiments.values() if "status" in experiment], self.status
+            )
+        experiment_names = {clearml_id: name for name, clearml_id in ids.items()}
+        for clearml_id, error in failed.items():
+            print(f"Failed to cancel experiment {experiment_names[clearml_id]}: {error}")
 
-    def delete(self, delete_from_clearml: bool = True, delete_from_gdrive: bool = True, delete_from_s3: bool = True):
+    @tracing.scoped
+    def delete(
+        self,
+        delete_from_clearml: bool = True,
+        delete_from_gdrive: bool = True,
+        delete_from_s3: bool = True,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
         if delete_from_clearml:
             try:
-                for _, obj in ENV.current_meta["investigations"][self.name].get("experiments", {}).items():
-                    task: Optional[Task] = Task.get_task(task_id=obj["clearml_id"])
-                    if task is not None:
-                        task.delete()
-            except:
-                print(f"Failed to delete investigation {self.name} from ClearML")
+                for name, e in self._delete_clearml_tasks(max_workers).items():
+                    print(f"Failed to delete ClearML task of experiment {name}: {e}")
+            except Exception as e:
+                print(f"Failed to delete investigation {self.name} from ClearML: {e}")
         if delete_from_gdrive:
             try:
                 ENV._delete_gdrive_folder(self.id)
-            except:
-                print(f"Failed to delete investigation {self.name} from Google Drive")
+            except Exception as e:
+                print(f"Failed to delete investigation {self.name} from Google Drive: {e}")
         if delete_from_s3:
             try:
-                ENV._delete_s3_folder(self.investigation_s3_path)
-            except:
-                print(f"Failed to delete investigation {self.name} from the S3 bucket")
+                failed_keys = ENV._delete_s3_folder(self.investigation_s3_path, max_workers)
+                if len(failed_keys) > 0:
+                    print(f"Failed to delete {len(failed_keys)} S3 objects of investigation {self.name}:")
+                    for failure in failed_keys[:10]:
+                        print(f"\t{failure}")
+            except Exception as e:
+                print(f"Failed to delete investigation {self.name} from the S3 bucket: {e}")
 
         del ENV.current_meta["investigations"][self.name]
         ENV.meta.flush()
         self = None
 
+    @tracing.scoped
+    def _delete_clearml_tasks(self, max_workers: int = DEFAULT_MAX_WORKERS) -> "dict[str, Exception]":
+        """Deletes the ClearML tasks of every experiment concurrently. Returns the errors keyed by experiment name"""
+        from tqdm import tqdm
+
+        tasks = {name: task for name, task in ENV._get_clearml_tasks(self.name).items() if task is not None}
+        failed: dict[str, Exception] = {}
+        if len(tasks) == 0:
+            return failed
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(ENV._delete_clearml_task, task): name for name, task in tasks.items()}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Deleting ClearML tasks"):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[futures[future]] = e
+        return failed
+
     def import_setup_from(self, other):
+        import gspread_dataframe as gd
+
         other_sheet_df = other._get_experiments_df()
         sheet = ENV.gc.open_by_key(self.sheet_id).sheet1
         gd.set_with_dataframe(sheet, other_sheet_df)
@@ -361,45 +724,188 @@ class InvestigationNotFoundError(Exception):
     """No such investigation in the current context"""
 
 
+class SyncError(Exception):
+    """One or more investigations could not be synced"""
+
+
+class _NoAliasDumper(yaml.SafeDumper):
+    def ignore_aliases(self, data):
+        return True
+
+
 class ClowderMeta:
+    """Local master meta file. `flush` marks the data dirty and writes it atomically, unless called within
+    `transaction`, in which case a single write happens when the outermost transaction exits. Outside of a
+    transaction, the file is only re-read when it has changed on disk"""
+
     def __init__(self, meta_filepath: str) -> None:
         self.filepath = meta_filepath
+        self._dirty = False
+        self._transaction_depth = 0
+        self._lock = RLock()
+        self._file_signature: Optional[tuple] = None
         if not Path.exists(Path("..", ".clowder")):
             os.mkdir("../.clowder")
         if not Path.is_file(Path(self.filepath)):
-            data = {"temp": {"investigations": {}}, "current_root": "temp"}
-            with open(self.filepath, "w") as f:
-                yaml.safe_dump(data, f)
-        with open(self.filepath, "r") as f:
-            self.data: Any = yaml.safe_load(f)
+            self._data: Any = {"temp": {"investigations": {}}, "current_root": "temp"}
+            self._write()
+        self._load()
+
+    @property
+    def data(self) -> Any:
+        with self._lock:
+            if not self._dirty and self._transaction_depth == 0 and self._signature() != self._file_signature:
+                self._load()
+            return self._data
 
     def flush(self):
-        with open(self.filepath, "w") as f:
-            yaml.safe_dump(self.data, f)
+        with self._lock:
+            self._dirty = True
+            if self._transaction_depth == 0:
+                self._write()
+
+    @contextmanager
+    def transaction(self):
+        """Groups the flushes of every mutation made within the block into one write"""
+        with self._lock:
+            self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0 and self._dirty:
+                    self._write()
+
+    def _signature(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
         with open(self.filepath, "r") as f:
-            self.data: Any = yaml.safe_load(f)
+            self._data = yaml.safe_load(f)
+        self._file_signature = self._signature()
+        self._dirty = False
+
+    def _write(self):
+        # Write to a temporary file in the same directory and rename it over the meta file so that an
+        # interrupted write never leaves a truncated file behind
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".clowder.meta.", delete=False) as f:
+            yaml.dump(self._data, f, Dumper=_NoAliasDumper)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.filepath)
+        self._file_signature = self._signature()
+        self._dirty = False
+
+
+class GDriveListingCache:
+    """Per-process cache of Drive folder listings keyed by folder id. Entries expire after `ttl` seconds and the
+    least recently used folder is evicted once more than `max_entries` folders are cached"""
+
+    def __init__(self, ttl: float = GDRIVE_LISTING_TTL, max_entries: int = GDRIVE_LISTING_MAX_ENTRIES) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple[float, dict[str, GoogleDriveFile]]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, folder_id: str) -> "Optional[dict[str, GoogleDriveFile]]":
+        with self._lock:
+            entry = self._entries.get(folder_id)
+            if entry is None or monotonic() - entry[0] > self.ttl:
+                self._entries.pop(folder_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(folder_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, folder_id: str, files: "dict[str, GoogleDriveFile]"):
+        with self._lock:
+            self._entries[folder_id] = (monotonic(), dict(files))
+            self._entries.move_to_end(folder_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add_file(self, folder_id: str, file_name: str, file: GoogleDriveFile):
+        """Records a file created or overwritten by clowder in an already cached listing"""
+        with self._lock:
+            entry = self._entries.get(folder_id)
+            if entry is not None:
+                entry[1][file_name] = file
+
+    def remove_file(self, file_id: str):
+        """Drops a deleted file (or folder) from every cached listing, including its own"""
+        with self._lock:
+            self._entries.pop(file_id, None)
+            for _, files in self._entries.values():
+                for file_name in [name for name, file in files.items() if file["id"] == file_id]:
+                    del files[file_name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> "dict[str, int]":
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
 
 
 class Environment:
     def __init__(self):
         self.meta = ClowderMeta("../.clowder/clowder.master.meta.yml")
+        self.listing_cache = GDriveListingCache()
+        self._clearml_tasks: dict[str, Task] = {}
+        self._clearml_task_data: dict[str, dict] = {}
         self.INVESTIGATIONS_GDRIVE_FOLDER = self.root
+        self.EXPERIMENTS_S3_FOLDER = (
+            "/aqua-ml-data/MT/experiments/clowder/"  # self._get_env_var("EXPERIMENTS_S3_FOLDER")
+        )
+        # Clients are created on first use
+        self._drive: Optional[GoogleDrive] = None
+        self._gc: Optional[gspread.Client] = None
+        self._clients_lock = Lock()
+        self._logs: dict[str, InvestigationLog] = {}
+        self._log_executor: Optional[ThreadPoolExecutor] = None
+        self._logs_lock = Lock()
+        atexit.register(self.flush_logs)
+
+    @property
+    def GOOGLE_CREDENTIALS_FILE(self) -> str:
+        if os.environ.get("GOOGLE_CREDENTIALS_FILE") is not None:
+            return self._get_env_var("GOOGLE_CREDENTIALS_FILE")
         try:
-            self.GOOGLE_CREDENTIALS_FILE = (
-                self._get_env_var("GOOGLE_CREDENTIALS_FILE")
-                if os.environ.get("GOOGLE_CREDENTIALS_FILE") is not None
-                else "../.clowder/"
+            return (
+                "../.clowder/"
                 + list(filter(lambda p: "clowder" in p and ".json" in p, os.listdir("../.clowder/")))[
                     0
                 ]  # TODO more robust
             )
         except IndexError:
             raise MissingConfigurationFile("No google credentials file found in .clowder directory")
-        self.EXPERIMENTS_S3_FOLDER = (
-            "/aqua-ml-data/MT/experiments/clowder/"  # self._get_env_var("EXPERIMENTS_S3_FOLDER")
-        )
-        self._setup_google_drive()
-        self.gc = gspread.service_account(filename=Path(self.GOOGLE_CREDENTIALS_FILE))
+
+    @property
+    def _google_drive(self) -> GoogleDrive:
+        with self._clients_lock:
+            if self._drive is None:
+                self._setup_google_drive()
+            return self._drive  # type: ignore
+
+    @property
+    def gc(self) -> gspread.Client:
+        with self._clients_lock:
+            if self._gc is None:
+                import gspread
+
+                self._gc = gspread.service_account(
+                    filename=Path(self.GOOGLE_CREDENTIALS_FILE), client_factory=quota.throttled_client_class()
+                )
+            return self._gc
 
     @property
     def root(self):
@@ -434,6 +940,9 @@ class Environment:
         self.meta.flush()
 
     def create_investigation(self, investigation_name: str) -> Investigation:
+        import gspread_dataframe as gd
+        import pandas as pd
+
         if self.investigation_exists(investigation_name):
             raise DuplicateInvestigationException(
                 f"There is already an investigation with name {investigation_name} in this context"
@@ -470,22 +979,171 @@ class Environment:
             "clowder_log_id": clowder_log_id,
             "clowder_config_yml_id": clowder_config_yml_id,
             "sheet_id": sheet_id,
+            "experiments": {},
         }
         ENV.add_investigation(investigation_name, investigation_data)
         return ENV.get_investigation(investigation_name)
 
-    def _get_clearml_tasks(self, investigation_name: str) -> "dict[str, Union[None,Task]]":
+    def _read_experiments_setup(self, sheet_id: str) -> pd.DataFrame:
+        """Records of the ExperimentsSetup sheet of spreadsheet `sheet_id`. A copy is kept locally and the sheet is
+        only downloaded again once the spreadsheet's Drive revision has changed"""
+        import pandas as pd
+
+        cache = SheetCache(sheet_id)
+        # Read the revision before the records so that an edit made in between is picked up next time
+        revision = self._gdrive_file_revision(sheet_id)
+        records = cache.get(revision)
+        if records is None:
+            records = pd.DataFrame(self.gc.open_by_key(sheet_id).sheet1.get_all_records())
+            cache.put(revision, records)
+        return records
+
+    def _clearml_ids(self, investigation_name: str) -> "dict[str, str]":
         if "experiments" not in self.current_meta["investigations"][investigation_name]:
             self.current_meta["investigations"][investigation_name]["experiments"] = {}
         experiments = self.current_meta["investigations"][investigation_name]["experiments"]
-        tasks = {}
+        ids = {}
         for experiment_name, obj in experiments.items():
-            clearml_id = obj["clearml_id"]
+            clearml_id = obj.get("clearml_id")
             if clearml_id is None or clearml_id == "unknown":
                 continue
-            task: Optional[Task] = Task.get_task(task_id=clearml_id)
-            tasks[experiment_name] = task
-        return tasks
+            ids[experiment_name] = clearml_id
+        return ids
+
+    def _get_clearml_tasks(self, investigation_name: str) -> "dict[str, Union[None,Task]]":
+        from clearml import Task
+
+        ids = self._clearml_ids(investigation_name)
+        missing = [clearml_id for clearml_id in ids.values() if clearml_id not in self._clearml_tasks]
+        for i in range(0, len(missing), CLEARML_TASKS_PER_QUERY):
+            with tracing.span("clearml.get_tasks"):
+                tasks = Task.get_tasks(task_ids=missing[i : i + CLEARML_TASKS_PER_QUERY])
+            for task in tasks:
+                self._clearml_tasks[task.id] = task
+        return {experiment_name: self._clearml_tasks.get(clearml_id) for experiment_name, clearml_id in ids.items()}
+
+    def _get_clearml_task_data(self, investigation_name: str, refresh: bool = False) -> "dict[str, Optional[dict]]":
+        """Returns the id and status of every task in an investigation, keyed by experiment name. Tasks are fetched
+        with ID-filtered bulk queries and reused for the rest of the command unless `refresh` is set"""
+        ids = self._clearml_ids(investigation_name)
+        missing = [clearml_id for clearml_id in ids.values() if refresh or clearml_id not in self._clearml_task_data]
+        self._clearml_task_data.update(self._query_clearml_tasks(missing, with_metrics=False))
+        return {experiment_name: self._clearml_task_data.get(clearml_id) for experiment_name, clearml_id in ids.items()}
+
+    def _get_clearml_task_metrics(self, task_ids: "list[str]") -> "dict[str, dict[str, dict[str, dict]]]":
+        """Returns the last scalar metrics of the given tasks, keyed by task id"""
+        return {clearml_id: data["metrics"] for clearml_id, data in self._query_clearml_tasks(task_ids).items()}
+
+    def _query_clearml_tasks(self, task_ids: "list[str]", with_metrics: bool = True) -> "dict[str, dict]":
+        from clearml import Task
+
+        data = {}
+        for i in range(0, len(task_ids), CLEARML_TASKS_PER_QUERY):
+            with tracing.span("clearml.query_tasks"):
+                tasks = Task.query_tasks(
+                    task_filter={"id": task_ids[i : i + CLEARML_TASKS_PER_QUERY]},
+                    additional_return_fields=["status", "last_metrics"] if with_metrics else ["status"],
+                )
+            for task in tasks:
+                data[task["id"]] = {"id": task["id"], "status": str(task["status"])}
+                if with_metrics:
+                    data[task["id"]]["metrics"] = self._last_scalar_metrics(task.get("last_metrics"))
+        return data
+
+    def _poll_clearml_statuses(self, investigation_names: "list[str]") -> "dict[str, dict[str, str]]":
+        """Fetches only the status of every task in the given investigations, keyed by investigation and experiment
+        name, with as few queries as possible"""
+        ids = {investigation_name: self._clearml_ids(investigation_name) for investigation_name in investigation_names}
+        data = self._query_clearml_tasks(
+            [clearml_id for experiment_ids in ids.values() for clearml_id in experiment_ids.values()],
+            with_metrics=False,
+        )
+        return {
+            investigation_name: {
+                experiment_name: data[clearml_id]["status"]
+                for experiment_name, clearml_id in experiment_ids.items()
+                if clearml_id in data
+            }
+            for investigation_name, experiment_ids in ids.items()
+        }
+
+    @staticmethod
+    def _last_scalar_metrics(last_metrics: Optional[dict]) -> "dict[str, dict[str, dict]]":
+        """Converts a task's raw `last_metrics` (keyed by metric and variant hashes) into the
+        {title: {series: {"last", "min", "max"}}} layout returned by Task.get_last_scalar_metrics"""
+        metrics: dict[str, dict[str, dict]] = {}
+        for variants in (last_metrics or {}).values():
+            for event in variants.values():
+                metrics.setdefault(_field(event, "metric"), {})[_field(event, "variant")] = {
+                    "last": _field(event, "value"),
+                    "min": _field(event, "min_value"),
+                    "max": _field(event, "max_value"),
+                }
+        return metrics
+
+    def _cancel_clearml_tasks(
+        self, task_ids: "list[str]", max_workers: int = DEFAULT_MAX_WORKERS
+    ) -> "tuple[dict[str, str], dict[str, str]]":
+        """Cancels every unfinished task among `task_ids`: queued tasks are removed from their queue and then, like
+        running tasks, stopped. Returns the status of each task afterwards and the error of each that could not be
+        cancelled"""
+        from clearml.backend_api.session.client import APIClient
+
+        statuses = {
+            clearml_id: data["status"]
+            for clearml_id, data in self._query_clearml_tasks(task_ids, with_metrics=False).items()
+        }
+        queued = [clearml_id for clearml_id, status in statuses.items() if status == "queued"]
+        to_stop = [
+            clearml_id for clearml_id, status in statuses.items() if status in ["queued", "in_progress", "created"]
+        ]
+        client = APIClient()
+        # A task that started running since its status was read cannot be dequeued, but is still stopped below
+        self._call_clearml_tasks_many(client, "dequeue", queued, max_workers)
+        failed = self._call_clearml_tasks_many(
+            client, "stop", to_stop, max_workers, force=True, status_reason="Task was stopped by user"
+        )
+        for clearml_id in to_stop:
+            if clearml_id not in failed:
+                statuses[clearml_id] = "stopped"
+        return statuses, failed
+
+    def _call_clearml_tasks_many(
+        self, client: Any, action: str, task_ids: "list[str]", max_workers: int = DEFAULT_MAX_WORKERS, **kwargs
+    ) -> "dict[str, str]":
+        """Calls the bulk `tasks.<action>_many` endpoint on batches of `task_ids`, falling back to concurrent
+        `tasks.<action>` calls on servers without it. Returns the error of each task the action failed for"""
+        failed: dict[str, str] = {}
+        for i in range(0, len(task_ids), CLEARML_TASKS_PER_QUERY):
+            batch = task_ids[i : i + CLEARML_TASKS_PER_QUERY]
+            try:
+                with tracing.span(f"clearml.{action}_many"):
+                    response = getattr(client.tasks, f"{action}_many")(ids=batch, **kwargs)
+            except Exception:
+                # Bulk task endpoints were added in ClearML server API 2.13
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(self._call_clearml_task, client, action, clearml_id, **kwargs): clearml_id
+                        for clearml_id in batch
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            failed[futures[future]] = str(e)
+                continue
+            for failure in _field(response, "failed") or []:
+                failed[_field(failure, "id")] = str(_field(failure, "error"))
+        return failed
+
+    def _call_clearml_task(self, client: Any, action: str, task_id: str, **kwargs):
+        with tracing.span(f"clearml.{action}"):
+            getattr(client.tasks, action)(task=task_id, **kwargs)
+
+    @traced("clearml.delete")
+    def _delete_clearml_task(self, task: Task):
+        if task.delete() is False:
+            raise RuntimeError(f"ClearML did not delete task {task.id}")
 
     def track_investigation_by_name(self, investigation_name: str):
         try:
@@ -516,16 +1174,30 @@ class Environment:
         return var
 
     def _setup_google_drive(self):
+        from oauth2client.service_account import ServiceAccountCredentials
+        from pydrive2.auth import GoogleAuth
+        from pydrive2.drive import GoogleDrive
+
         gauth = GoogleAuth()
         gauth.auth_method = "service"
         gauth.credentials = ServiceAccountCredentials.from_json_keyfile_name(
             self.GOOGLE_CREDENTIALS_FILE, scopes=GDRIVE_SCOPE
         )
-        self._google_drive = GoogleDrive(gauth)
+        self._drive = GoogleDrive(gauth)
 
     def _dict_of_gdrive_files(self, folder_id: str) -> "dict[str, GoogleDriveFile]":
-        files = self._google_drive.ListFile({"q": f"trashed=false and '{folder_id}' in parents"}).GetList()
-        return {f["title"]: f for f in files}
+        cached = self.listing_cache.get(folder_id)
+        if cached is not None:
+            return cached
+        files = self._query_gdrive_files(f"trashed=false and '{folder_id}' in parents")
+        files_dict = {f["title"]: f for f in files}
+        self.listing_cache.put(folder_id, files_dict)
+        return files_dict
+
+    @throttled("drive.read")
+    @traced("drive.list")
+    def _query_gdrive_files(self, query: str) -> "list[GoogleDriveFile]":
+        return self._google_drive.ListFile({"q": query}).GetList()
 
     def _list_gdrive_files(self, folder_id: str) -> "list[GoogleDriveFile]":
         return list(self._dict_of_gdrive_files(folder_id).values())
@@ -533,12 +1205,25 @@ class Environment:
     def _read_gdrive_file_as_string(self, file_id: str) -> str:
         return self._read_gdrive_file_as_bytes(file_id).decode("utf-8")
 
+    @throttled("drive.read")
+    @traced("drive.read")
     def _read_gdrive_file_as_bytes(self, file_id: str) -> bytes:
         file = self._google_drive.CreateFile({"id": file_id})
         buffer: MediaIoReadable = file.GetContentIOBuffer()
         b = buffer.read()
+        tracing.add_bytes(len(b) if b is not None else 0)
         return b if b is not None else b""  # type: ignore
 
+    @throttled("drive.read")
+    @traced("drive.metadata")
+    def _gdrive_file_revision(self, file_id: str) -> str:
+        """Version and modification time of a Drive file, which change with every edit to it"""
+        file = self._google_drive.CreateFile({"id": file_id})
+        file.FetchMetadata(fields="version,modifiedDate")
+        return f"{file['version']}:{file['modifiedDate']}"
+
+    @throttled("drive.write")
+    @traced("drive.write")
     def _write_gdrive_file_in_folder(
         self, parent_folder_id: str, file_name: str, content: Union[str, bytes], file_type: Optional[str] = None
     ) -> str:
@@ -557,13 +1242,20 @@ class Environment:
             )
         fh.SetContentString(content)
         fh.Upload()
+        tracing.add_bytes(len(content.encode("utf-8") if isinstance(content, str) else content))
+        self.listing_cache.add_file(parent_folder_id, file_name, fh)
         return fh["id"]
 
+    @throttled("drive.write")
+    @traced("drive.delete")
     def _delete_gdrive_folder(self, folder_id: str) -> str:
         fh = self._google_drive.CreateFile({"id": folder_id})
         fh.Delete()
+        self.listing_cache.remove_file(folder_id)
         return fh["id"]
 
+    @throttled("drive.write")
+    @traced("drive.create_folder")
     def _create_gdrive_folder(self, folder_name: str, parent_folder_id: str) -> str:
         files = self._dict_of_gdrive_files(parent_folder_id)
         if folder_name in files:
@@ -576,21 +1268,56 @@ class Environment:
             }
         )
         fh.Upload()
+        self.listing_cache.add_file(parent_folder_id, folder_name, fh)
+        self.listing_cache.put(fh["id"], {})
         return fh["id"]
 
     def _find_investigations(
-        self, folder_id: str, by_name: Optional[str] = None, files_acc: "set[str]" = set()
+        self, folder_id: str, by_name: Optional[str] = None, max_workers: int = DEFAULT_MAX_WORKERS
     ) -> "set[str]":
-        files = self._dict_of_gdrive_files(folder_id)
-        for filename, file in files.items():
-            if filename == "clowder.meta.yml":
-                files_acc.add(folder_id)
-            if file["mimeType"] == "application/vnd.google-apps.folder":
-                if (not by_name) or (file["title"] == by_name):
-                    files_acc = files_acc.union(
-                        self._find_investigations(file["id"], by_name=by_name, files_acc=files_acc)
-                    )
-        return files_acc
+        """Breadth-first search for folders containing a clowder.meta.yml below `folder_id`. Each level of the tree is
+        listed with a few batched queries run concurrently, and an investigation's experiments folder is not
+        descended into"""
+        investigation_ids: set[str] = set()
+        level = [folder_id]
+        while len(level) > 0:
+            next_level = []
+            for parent_id, files in self._dict_of_gdrive_files_in_folders(level, max_workers).items():
+                is_investigation = "clowder.meta.yml" in files
+                if is_investigation:
+                    investigation_ids.add(parent_id)
+                for filename, file in files.items():
+                    if file["mimeType"] != "application/vnd.google-apps.folder":
+                        continue
+                    if is_investigation and filename == "experiments":
+                        continue
+                    if (not by_name) or (filename == by_name):
+                        next_level.append(file["id"])
+            level = next_level
+        return investigation_ids
+
+    def _dict_of_gdrive_files_in_folders(
+        self, folder_ids: "list[str]", max_workers: int = DEFAULT_MAX_WORKERS
+    ) -> "dict[str, dict[str, GoogleDriveFile]]":
+        """Lists the children of many folders at once by grouping several parents into each query"""
+        listings: dict[str, dict[str, GoogleDriveFile]] = {folder_id: {} for folder_id in folder_ids}
+        batches = [
+            folder_ids[i : i + GDRIVE_PARENTS_PER_QUERY] for i in range(0, len(folder_ids), GDRIVE_PARENTS_PER_QUERY)
+        ]
+
+        def list_batch(batch: "list[str]") -> "list[GoogleDriveFile]":
+            parents_query = " or ".join(f"'{folder_id}' in parents" for folder_id in batch)
+            return self._query_gdrive_files(f"trashed=false and ({parents_query})")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for files in executor.map(list_batch, batches):
+                for file in files:
+                    for parent in file["parents"]:
+                        if parent["id"] in listings:
+                            listings[parent["id"]][file["title"]] = file
+        for folder_id, files in listings.items():
+            self.listing_cache.put(folder_id, files)
+        return listings
 
     def _track_investigation_in_folder(self, folder_id: str):
         files = self._dict_of_gdrive_files(folder_id)
@@ -642,60 +1369,228 @@ class Environment:
 
     def _track_all_investigations_in_folder(self, folder_id: str):
         files = self._find_investigations(folder_id)
-        for file in files:
-            try:
-                self._track_investigation_in_folder(file)
-            except DuplicateInvestigationException:
-                pass
+        with self.meta.transaction():
+            for file in files:
+                try:
+                    self._track_investigation_in_folder(file)
+                except DuplicateInvestigationException:
+                    pass
 
     # TODO types!
 
     def log(self, investigation_name: str, data: str):
-        current_log = self._read_gdrive_file_as_string(
-            self.current_meta["investigation"][investigation_name]["clowder_log_id"]
-        )
-        new_id = self._write_gdrive_file_in_folder(
-            self.current_meta["investigation"][investigation_name]["id"],
-            "clowder.log",
-            current_log + "\n" + datetime.datetime.now().isoformat() + " | " + data,
-        )
-        self.current_meta["investigation"][investigation_name]["clowder_log_id"] = new_id
-        self.meta.flush()
+        """Appends `data` to the investigation's log. Entries are buffered locally and uploaded in the background
+        in batches, with anything left over uploaded when the command exits"""
+        log = self._investigation_log(investigation_name)
+        if log.append(datetime.datetime.now().isoformat() + " | " + data):
+            with self._logs_lock:
+                if self._log_executor is None:
+                    self._log_executor = ThreadPoolExecutor(max_workers=1)
+                self._log_executor.submit(log.flush)
+
+    def flush_logs(self):
+        with self._logs_lock:
+            executor, self._log_executor = self._log_executor, None
+            logs = list(self._logs.values())
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for log in logs:
+            try:
+                log.flush()
+            except Exception as e:
+                print(f"Failed to upload clowder log: {e}")
+
+    def trace_report(self, by_investigation: bool = True) -> dict:
+        """Calls made to external services so far in this process, with the Drive listing cache's hit rate"""
+        return {
+            "operations": tracing.summary(by_investigation),
+            "listing_cache": self.listing_cache.stats(),
+        }
 
-    def _copy_gdrive_folder_to_s3(self, folder_id: str, s3_path: s3path.S3Path):
-        # print(f"Copying folder {folder_id} to {s3_path}")
-        for file in self._list_gdrive_files(folder_id):
-            s3_file = s3_path / file["title"]
-            if file["mimeType"] == "application/vnd.google-apps.folder":
-                self._copy_gdrive_folder_to_s3(file["id"], s3_file)
-            else:
-                with s3_file.open("wb") as f:
-                    data = self._read_gdrive_file_as_bytes(file["id"])
-                    # print(data.decode("utf-8"))
-                    f.write(data)
-
-    def _copy_s3_folder_to_gdrive(self, s3_path: s3path.S3Path, folder_id: str):
-        for file in s3_path.iterdir():
-            if file.is_dir():
-                id = self._create_gdrive_folder(file.name, folder_id)
-                self._copy_s3_folder_to_gdrive(file, id)
-            else:
+    def _investigation_log(self, investigation_name: str) -> InvestigationLog:
+        investigation_id = self.current_meta["investigations"][investigation_name]["id"]
+        with self._logs_lock:
+            if investigation_id not in self._logs:
+                self._logs[investigation_id] = InvestigationLog(
+                    investigation_id,
+                    lambda file_name, content: self._write_gdrive_file_in_folder(investigation_id, file_name, content),
+                )
+            return self._logs[investigation_id]
+
+    def _copy_gdrive_folders_to_s3(
+        self,
+        folders: "list[tuple[str, s3path.S3Path]]",
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        on_copied: Optional[Callable[[int], Any]] = None,
+    ) -> None:
+        """Copies each Drive folder in `folders` to its S3 path, calling `on_copied` with the index of each folder
+        once all of its files have been copied"""
+        files = [
+            (index, file_id, s3_file)
+            for index, (folder_id, s3_path) in enumerate(folders)
+            for file_id, s3_file in self._list_gdrive_tree(folder_id, s3_path)
+        ]
+        remaining = Counter(index for index, _, _ in files)
+        if on_copied is not None:
+            for index in range(len(folders)):
+                if remaining[index] == 0:
+                    on_copied(index)
+        if len(files) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._stream_gdrive_file_to_s3, file_id, s3_file): index
+                for index, file_id, s3_file in files
+            }
+            for future in as_completed(futures):
+                future.result()
+                index = futures[future]
+                remaining[index] -= 1
+                if remaining[index] == 0 and on_copied is not None:
+                    on_copied(index)
+
+    def _list_gdrive_tree(self, folder_id: str, s3_path: s3path.S3Path) -> "list[tuple[str, s3path.S3Path]]":
+        """Lists every file below folder `folder_id` paired with its destination under `s3_path`"""
+        files = []
+        folders = [(folder_id, s3_path)]
+        while len(folders) > 0:
+            current_folder_id, current_s3_path = folders.pop()
+            for file in self._list_gdrive_files(current_folder_id):
+                s3_file = current_s3_path / file["title"]
+                if file["mimeType"] == "application/vnd.google-apps.folder":
+                    folders.append((file["id"], s3_file))
+                else:
+                    files.append((file["id"], s3_file))
+        return files
+
+    @throttled("drive.read")
+    @traced("drive.copy_to_s3")
+    def _stream_gdrive_file_to_s3(self, file_id: str, s3_file: s3path.S3Path):
+        # A fresh GoogleDriveFile per transfer gets its own http object, so transfers can run on separate threads.
+        # The S3 writer uploads in multipart chunks once the stream grows past its part size.
+        file = self._google_drive.CreateFile({"id": file_id})
+        buffer: MediaIoReadable = file.GetContentIOBuffer(chunksize=GDRIVE_CHUNK_SIZE)
+        with s3_file.open("wb") as f:
+            for chunk in buffer:
+                if chunk is not None:
+                    f.write(chunk)
+                    tracing.add_bytes(len(chunk))
+
+    def _copy_s3_folder_to_gdrive(
+        self,
+        s3_path: s3path.S3Path,
+        folder_id: str,
+        manifest: Optional[dict] = None,
+        objects: Optional[list] = None,
+    ):
+        """Copies every object under `s3_path` into Drive folder `folder_id`. When a `manifest` is given, objects
+        whose ETag, size and modification time match their entry are skipped and the manifest is updated in place
+        with what was copied successfully. `objects` are the objects under `s3_path` if they have already been
+        listed"""
+        if manifest is None:
+            manifest = {"objects": {}, "folders": {}}
+        if objects is None:
+            objects = self._list_s3_objects(s3_path)
+        prefix = s3_path.key.rstrip("/") + "/"
+        manifest["folders"][prefix] = folder_id
+        for obj in objects:
+            if obj.key.endswith("/"):
+                continue
+            mtime = obj.last_modified.isoformat()
+            entry = manifest["objects"].get(obj.key)
+            if (
+                entry is not None
+                and entry["etag"] == obj.e_tag
+                and entry["size"] == obj.size
+                and entry["mtime"] == mtime
+            ):
+                continue
+            parent_prefix, _, file_name = obj.key.rpartition("/")
+            parent_id = self._create_gdrive_folders_for_prefix(parent_prefix + "/", manifest["folders"])
+            gdrive_id = None
+            try:
+                with tracing.span("s3.read"):
+                    body = obj.get()["Body"].read()
+                    tracing.add_bytes(len(body))
+                content = body.decode("utf-8")
+                if entry is not None and entry.get("gdrive_id") is not None:
+                    gdrive_id = self._overwrite_gdrive_file(entry["gdrive_id"], content)
+                if gdrive_id is None:
+                    gdrive_id = self._write_gdrive_file_in_folder(parent_id, file_name, content)
+            except Exception:
+                # Left out of the manifest so that the next sync tries again
+                print(f"Failed to copy file {file_name} to GDrive folder {parent_id}")
+                continue
+            manifest["objects"][obj.key] = {"etag": obj.e_tag, "size": obj.size, "mtime": mtime, "gdrive_id": gdrive_id}
+
+    def _create_gdrive_folders_for_prefix(self, prefix: str, folders: "dict[str, str]") -> str:
+        """Returns the id of the Drive folder mirroring S3 `prefix`, creating it and any missing parents. `folders`
+        maps already-known prefixes to folder ids and must contain an ancestor of `prefix`"""
+        if prefix in folders:
+            return folders[prefix]
+        parent_prefix, _, folder_name = prefix.rstrip("/").rpartition("/")
+        parent_id = self._create_gdrive_folders_for_prefix(parent_prefix + "/", folders)
+        folders[prefix] = self._create_gdrive_folder(folder_name, parent_id)
+        return folders[prefix]
+
+    @throttled("drive.write")
+    @traced("drive.overwrite")
+    def _overwrite_gdrive_file(self, file_id: str, content: str) -> Optional[str]:
+        """Overwrites the content of an existing Drive file without listing its folder. Returns None if the file
+        no longer exists"""
+        from pydrive2.files import ApiRequestError
+
+        try:
+            fh = self._google_drive.CreateFile({"id": file_id})
+            fh.SetContentString(content)
+            fh.Upload()
+            tracing.add_bytes(len(content.encode("utf-8")))
+        except ApiRequestError as e:
+            if quota.status_code(e) != 404:
+                raise
+            return None
+        return fh["id"]
+
+    @traced("s3.list")
+    def _list_s3_objects(self, s3_path: s3path.S3Path) -> list:
+        """Lists every object under `s3_path` with its ETag, size and modification time in a single paginated
+        listing"""
+        import boto3
+
+        bucket = boto3.resource("s3").Bucket(s3_path.bucket)
+        return list(bucket.objects.filter(Prefix=s3_path.key.rstrip("/") + "/"))
+
+    def _delete_s3_folder(self, s3_path: s3path.S3Path, max_workers: int = DEFAULT_MAX_WORKERS) -> "list[str]":
+        """Deletes every object under `s3_path` using a single listing and multi-object deletes of up to
+        S3_DELETE_BATCH_SIZE keys. Returns a description of each object that could not be deleted"""
+        import boto3
+        from tqdm import tqdm
+
+        keys = [obj.key for obj in self._list_s3_objects(s3_path)]
+        if len(keys) == 0:
+            return []
+        bucket = boto3.resource("s3").Bucket(s3_path.bucket)
+        batches = [keys[i : i + S3_DELETE_BATCH_SIZE] for i in range(0, len(keys), S3_DELETE_BATCH_SIZE)]
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(
+            total=len(keys), desc="Deleting S3 objects"
+        ) as progress:
+            futures = {executor.submit(self._delete_s3_objects, bucket, batch): batch for batch in batches}
+            for future in as_completed(futures):
                 try:
-                    with file.open("r") as f:
-                        self._write_gdrive_file_in_folder(folder_id, file.name, f.read())
-                except:
-                    print(f"Failed to copy file {file.name} to GDrive folder {folder_id}")
-
-    def _delete_s3_file(self, s3_path: s3path.S3Path):
-        s3_path.unlink(missing_ok=True)
-
-    def _delete_s3_folder(self, s3_path: s3path.S3Path):
-        for child in s3_path.iterdir():
-            if child.is_dir():
-                self._delete_s3_folder(child)
-            else:
-                self._delete_s3_file(child)
-        s3_path.rmdir()
+                    failed.extend(future.result())
+                except Exception as e:
+                    failed.extend(f"{key}: {e}" for key in futures[future])
+                progress.update(len(futures[future]))
+        return failed
+
+    @traced("s3.delete_objects")
+    def _delete_s3_objects(self, bucket: Any, keys: "list[str]") -> "list[str]":
+        response = bucket.delete_objects(Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True})
+        return [
+            f"{error['Key']}: {error.get('Message', error.get('Code', 'unknown error'))}"
+            for error in response.get("Errors", [])
+        ]
 
 
 ENV = Environment()
@@ -1,6 +1,19 @@
 from typing import Optional
-from clowder.environment import ENV, Investigation, DuplicateExperimentException, Environment
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from clowder.environment import (
+    ENV,
+    Investigation,
+    DuplicateExperimentException,
+    Environment,
+    SyncError,
+    DEFAULT_MAX_WORKERS,
+)
 from clowder.status import Status
+from clowder.results_cache import ResultsCache
+
+WATCH_INTERVAL = 30.0
+WATCH_MAX_INTERVAL = 600.0
 
 # TODO remote logging (ignore for mvp)
 
@@ -9,12 +22,12 @@ def untrack(investigation_name: str):
     ENV.get_investigation(investigation_name).delete(delete_from_clearml=False, delete_from_gdrive=False, delete_from_s3=False)  # type: ignore
 
 
-def track(investigation_name: Optional[str]):
+def track(investigation_name: Optional[str], max_workers: int = DEFAULT_MAX_WORKERS):
     if investigation_name is not None:
         ENV.track_investigation_by_name(investigation_name)
     else:
         ENV.track_all_investigations()
-    sync(investigation_name)
+    sync(investigation_name, max_workers=max_workers)
 
 
 def create_from_template(from_investigation_name: str, new_investigation_name: str):
@@ -38,8 +51,11 @@ def delete(
     delete_from_clearml: bool = True,
     delete_from_google_drive: bool = True,
     delete_from_s3: bool = True,
+    max_workers: int = DEFAULT_MAX_WORKERS,
 ):
-    ENV.get_investigation(investigation_name).delete(delete_from_clearml, delete_from_google_drive, delete_from_s3)
+    ENV.get_investigation(investigation_name).delete(
+        delete_from_clearml, delete_from_google_drive, delete_from_s3, max_workers
+    )
 
 
 def idfor(investigation_name: str) -> str:
@@ -49,56 +65,128 @@ def idfor(investigation_name: str) -> str:
 
 def urlfor(investigation_name: str) -> str:
     """Returns url for investigation with name `investigation_name` in current context"""
-    return f"https://drive.google.com/drive/u/0/folders/{idfor(investigation_name)}"
+    return _gdrive_url(idfor(investigation_name))
+
 
+def _gdrive_url(folder_id: str) -> str:
+    return f"https://drive.google.com/drive/u/0/folders/{folder_id}"
 
-def cancel(investigation_name: str):
-    ENV.get_investigation(investigation_name).cancel()
 
+def cancel(investigation_name: str, max_workers: int = DEFAULT_MAX_WORKERS):
+    ENV.get_investigation(investigation_name).cancel(max_workers)
+    ENV.log(investigation_name, "Canceled investigation")
 
-def run(investigation_name: str, force_rerun: bool = False) -> bool:
+
+def run(investigation_name: str, force_rerun: bool = False, max_workers: int = DEFAULT_MAX_WORKERS) -> bool:
     sync(investigation_name, gather_results=False)
     investigation = ENV.get_investigation(investigation_name)
     if investigation.status.value == Status.Running.value:
         return False
-    investigation.setup()
-    now_running = investigation.start_investigation(force_rerun)
+    investigation.setup(max_workers)
+    now_running = investigation.start_investigation(force_rerun, max_workers)
     if now_running:
         investigation.status = Status.Running
+        ENV.log(investigation_name, f"Started investigation (force_rerun={force_rerun})")
     sync(investigation_name)
     return now_running
 
 
-def status(investigation_name: Optional[str], _sync: bool = True) -> dict:
-    """Returns status of investigation with name `investigation_name` in the current context"""
+def status(investigation_name: Optional[str], _sync: bool = True, max_age: Optional[float] = None) -> dict:
+    """Returns status of investigation with name `investigation_name` in the current context. If `max_age` is
+    given, only investigations last synced more than `max_age` seconds ago are synced before reporting"""
+    if investigation_name is not None and (_sync or ENV.investigation_exists(investigation_name)):
+        investigations = [ENV.get_investigation(investigation_name)]
+    else:
+        investigations = ENV.investigations
     if _sync:
-        sync(investigation_name)
-    if investigation_name is not None:
-        if ENV.investigation_exists(investigation_name):
-            return {
-                investigation_name: {
-                    "status": ENV.get_investigation(investigation_name).status,
-                    "experiments": ENV.get_investigation(investigation_name).experiments,
-                    "gdrive_url": urlfor(investigation_name),
-                }
-            }
+        now = time()
+        stale = [inv for inv in investigations if max_age is None or now - inv.synced_at > max_age]
+        if len(stale) == 1:
+            stale[0].sync()
+        elif len(stale) > 1:
+            _sync_investigations(stale)
     return {
-        inv.name: {"status": inv.status, "experiments": inv.experiments, "gdrive_url": urlfor(inv.name)}
-        for inv in ENV.investigations
+        inv.name: {"status": inv.status, "experiments": inv.experiments, "gdrive_url": _gdrive_url(inv.id)}
+        for inv in investigations
     }
 
 
-def sync(investigation_name: Optional[str], gather_results: bool = True):
+def sync(investigation_name: Optional[str], gather_results: bool = True, max_workers: int = DEFAULT_MAX_WORKERS):
+    """Syncs investigation with name `investigation_name`, or every investigation in the current context
+    with up to `max_workers` investigations syncing at the same time. When syncing several investigations,
+    the others are still synced if one fails, and a SyncError naming the failed ones is raised afterwards"""
     if investigation_name is not None:
         ENV.get_investigation(investigation_name).sync(gather_results=gather_results)
-    else:
-        for investigation in ENV.investigations:
-            investigation.sync(gather_results=gather_results)
+        return
+    _sync_investigations(ENV.investigations, gather_results, max_workers)
+
+
+def _sync_investigations(
+    investigations: "list[Investigation]", gather_results: bool = True, max_workers: int = DEFAULT_MAX_WORKERS
+):
+    from tqdm import tqdm
+
+    failed: dict[str, Exception] = {}
+    # Each investigation only updates its own entry in the meta; the transaction defers writing the file
+    # until every sync has finished
+    with ENV.meta.transaction(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(inv.sync, gather_results=gather_results): inv.name for inv in investigations}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Syncing investigations"):
+            try:
+                future.result()
+            except Exception as e:
+                failed[futures[future]] = e
+    for name, e in failed.items():
+        print(f"Failed to sync investigation {name}: {e}")
+    if len(failed) > 0:
+        raise SyncError(f"Failed to sync {len(failed)} of {len(investigations)} investigations: {', '.join(failed)}")
+
+
+def load_results(investigation_name: str) -> dict:
+    """Returns the locally cached results of investigation with name `investigation_name` in the current context,
+    keyed by result name, without accessing any remote services"""
+    return ResultsCache(ENV.get_investigation(investigation_name).id).load()
+
+
+def watch(interval: float = WATCH_INTERVAL, max_interval: float = WATCH_MAX_INTERVAL, gather_results: bool = True):
+    """Polls ClearML for status changes in the tasks of running investigations in the current context and syncs
+    only the investigations whose tasks changed. The polling interval doubles while nothing changes, up to
+    `max_interval` seconds, and returns to `interval` after a change. Returns once no investigation is running"""
+    last_statuses: dict[str, dict[str, str]] = {}
+    wait = interval
+    while True:
+        running = [inv for inv in ENV.investigations if inv.status.value == Status.Running.value]
+        if len(running) == 0:
+            print("No running investigations to watch")
+            return
+        statuses = ENV._poll_clearml_statuses([inv.name for inv in running])
+        changed = []
+        for inv in running:
+            previous = last_statuses.get(
+                inv.name, {exp: inv.experiments[exp].get("status") for exp in statuses[inv.name]}
+            )
+            if statuses[inv.name] != previous:
+                changed.append(inv)
+            last_statuses[inv.name] = statuses[inv.name]
+        for inv in changed:
+            print(f"Tasks in investigation {inv.name} changed status, syncing")
+            inv.sync(gather_results=gather_results)
+        if len(changed) > 0:
+            wait = interval
+        sleep(wait)
+        wait = min(wait * 2, max_interval)
 
 
 def create(investigation_name: str):
     """Create an empty investigation with name `investigation_name`"""
     ENV.create_investigation(investigation_name)
+    ENV.log(investigation_name, "Created investigation")
+
+
+def trace_report(by_investigation: bool = True) -> dict:
+    """Returns the count, latency, bytes transferred and errors of every external call made by this command,
+    per investigation and operation unless `by_investigation` is False"""
+    return ENV.trace_report(by_investigation)
 
 
 def use_context(root_folder_id: str):
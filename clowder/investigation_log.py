@@ -0,0 +1,80 @@
+import datetime
+import os
+from threading import Lock
+from typing import Callable
+
+import yaml
+
+LOG_SPOOL_FOLDER = "../.clowder/logs"
+LOG_FLUSH_ENTRIES = 20
+LOG_SEGMENT_MAX_BYTES = 256 * 1024
+
+
+class InvestigationLog:
+    """Append-only log of an investigation. Entries are appended to a local copy of the current segment right away
+    and uploaded in batches with `upload(file_name, content)`, which replaces the segment file in the investigation
+    folder. Once a segment grows past LOG_SEGMENT_MAX_BYTES a new one is started, so an upload never carries more
+    than one segment regardless of how long the investigation has been logging"""
+
+    def __init__(self, investigation_id: str, upload: Callable[[str, str], object]) -> None:
+        self._upload = upload
+        self._folder = os.path.join(LOG_SPOOL_FOLDER, investigation_id)
+        self._segment_path = os.path.join(self._folder, "segment.log")
+        self._state_path = os.path.join(self._folder, "state.yml")
+        self._append_lock = Lock()
+        self._flush_lock = Lock()
+        os.makedirs(self._folder, exist_ok=True)
+        state = {}
+        if os.path.isfile(self._state_path):
+            with open(self._state_path, "r") as f:
+                state = yaml.safe_load(f) or {}
+        if "segment" not in state or not os.path.isfile(self._segment_path):
+            state = {"segment": self._new_segment_name(), "pending": 0}
+            open(self._segment_path, "w").close()
+        self._segment: str = state["segment"]
+        self._pending: int = state["pending"]
+        self._save_state()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def append(self, entry: str) -> bool:
+        """Appends `entry` locally. Returns True once enough entries are pending that the log should be flushed"""
+        with self._append_lock:
+            with open(self._segment_path, "a") as f:
+                f.write(entry.rstrip("\n") + "\n")
+            self._pending += 1
+            self._save_state()
+            return self._pending >= LOG_FLUSH_ENTRIES
+
+    def flush(self):
+        with self._flush_lock:
+            with self._append_lock:
+                if self._pending == 0:
+                    return
+                flushed = self._pending
+                segment = self._segment
+                with open(self._segment_path, "r") as f:
+                    content = f.read()
+            self._upload(segment, content)
+            with self._append_lock:
+                self._pending -= flushed
+                if len(content.encode("utf-8")) >= LOG_SEGMENT_MAX_BYTES:
+                    # Entries appended during the upload are carried over into the next segment
+                    with open(self._segment_path, "r") as f:
+                        remainder = f.read()[len(content) :]
+                    with open(self._segment_path, "w") as f:
+                        f.write(remainder)
+                    self._segment = self._new_segment_name()
+                self._save_state()
+
+    def _save_state(self):
+        with open(self._state_path, "w") as f:
+            yaml.safe_dump({"segment": self._segment, "pending": self._pending}, f)
+
+    @staticmethod
+    def _new_segment_name() -> str:
+        # Segments are named by when they were started so that segments written from different machines never
+        # overwrite each other
+        return f"clowder.{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%f')}.log"
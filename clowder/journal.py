@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+from threading import Lock
+from typing import Any
+
+JOURNAL_FOLDER = "../.clowder/journal"
+
+
+class OperationJournal:
+    """Steps completed so far by a long-running operation on an investigation, e.g. 'setup', so that rerunning an
+    interrupted operation resumes where it stopped. Steps are appended to ../.clowder/journal/<investigation id>.jsonl
+    as they complete, one JSON line each, and the operation's steps are cleared once it finishes successfully"""
+
+    def __init__(self, investigation_id: str, operation: str) -> None:
+        self.operation = operation
+        self.path = os.path.join(JOURNAL_FOLDER, f"{investigation_id}.jsonl")
+        self._lock = Lock()
+        self.steps: dict[str, Any] = {}
+        for entry in self._entries():
+            if entry["operation"] == operation:
+                self.steps[entry["step"]] = entry["value"]
+
+    def get(self, step: str, default: Any = None) -> Any:
+        return self.steps.get(step, default)
+
+    def record(self, step: str, value: Any = True):
+        with self._lock:
+            os.makedirs(JOURNAL_FOLDER, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"operation": self.operation, "step": step, "value": value}) + "\n")
+            self.steps[step] = value
+
+    def clear(self):
+        with self._lock:
+            self.steps = {}
+            remaining = [entry for entry in self._entries() if entry["operation"] != self.operation]
+            if len(remaining) == 0:
+                if os.path.isfile(self.path):
+                    os.remove(self.path)
+                return
+            with tempfile.NamedTemporaryFile("w", dir=JOURNAL_FOLDER, prefix=".journal.", delete=False) as f:
+                for entry in remaining:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(f.name, self.path)
+
+    def _entries(self) -> "list[dict]":
+        if not os.path.isfile(self.path):
+            return []
+        entries = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last line is cut short if clowder was killed while writing it
+                    continue
+        return entries
@@ -0,0 +1,133 @@
+import random
+from functools import lru_cache, wraps
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Optional
+
+import tracing
+
+# (requests per second, burst size) for each API; Sheets allows 60 read and 60 write requests per minute per user
+RATE_LIMITS = {
+    "drive.read": (15.0, 30),
+    "drive.write": (5.0, 10),
+    "sheets.read": (1.0, 10),
+    "sheets.write": (1.0, 10),
+}
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average with bursts of up to `capacity` calls"""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+
+_buckets: "dict[str, TokenBucket]" = {}
+_buckets_lock = Lock()
+
+
+def configure(api: str, rate: float, capacity: Optional[int] = None):
+    """Sets the rate (calls per second) and burst size used for `api`, e.g. 'sheets.write'"""
+    with _buckets_lock:
+        RATE_LIMITS[api] = (rate, capacity if capacity is not None else max(1, int(rate)))
+        _buckets.pop(api, None)
+
+
+def bucket(api: str) -> TokenBucket:
+    with _buckets_lock:
+        if api not in _buckets:
+            _buckets[api] = TokenBucket(*RATE_LIMITS[api])
+        return _buckets[api]
+
+
+def status_code(e: Exception) -> Optional[int]:
+    """HTTP status of a googleapiclient, pydrive2 or gspread error, if any"""
+    for response in (getattr(e, "resp", None), getattr(e, "response", None)):
+        if response is None:
+            continue
+        code = getattr(response, "status", None)
+        if code is None:
+            code = getattr(response, "status_code", None)
+        if code is not None:
+            return int(code)
+    error = getattr(e, "error", None)
+    if isinstance(error, dict) and "code" in error:
+        return int(error["code"])
+    return None
+
+
+def is_quota_error(e: Exception) -> bool:
+    code = status_code(e)
+    if code == 429:
+        return True
+    return code == 403 and "ratelimitexceeded" in str(e).lower()
+
+
+def is_retryable(e: Exception) -> bool:
+    code = status_code(e)
+    return is_quota_error(e) or (code is not None and 500 <= code < 600)
+
+
+def call(api: str, func: Callable, *args, **kwargs) -> Any:
+    """Calls `func` once a token for `api` is available, retrying quota and server errors with jittered
+    exponential backoff"""
+    attempt = 0
+    while True:
+        bucket(api).acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not is_retryable(e):
+                raise
+            sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)))
+            attempt += 1
+
+
+def throttled(api: str):
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return call(api, func, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def throttled_client_class() -> type:
+    """gspread client class whose requests all go through the Sheets rate limiters. Built on first use so that
+    gspread is only imported when Sheets are accessed"""
+    import gspread
+
+    class ThrottledClient(gspread.Client):
+        def request(self, method: str, *args, **kwargs):
+            api = "sheets.read" if method.lower() == "get" else "sheets.write"
+            return call(api, self._traced_request, method, *args, **kwargs)
+
+        def _traced_request(self, method: str, *args, **kwargs):
+            with tracing.span(f"sheets.{method.lower()}"):
+                response = super().request(method, *args, **kwargs)
+                tracing.add_bytes(len(response.content))
+                return response
+
+    return ThrottledClient
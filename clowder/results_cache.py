@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from threading import Lock
+from typing import TYPE_CHECKING, Optional
+
+import yaml
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+RESULTS_CACHE_FOLDER = "../.clowder/results"
+METRICS_RESULT_NAME = "clearml_metrics"
+
+
+class ResultsCache:
+    """On-disk cache of an investigation's parsed results. Each experiment's results csvs are stored keyed by the
+    ETag of the S3 object they were read from, and the ClearML metrics of finished tasks keyed by task id, so that
+    only new or changed results need to be downloaded and the cache can be loaded without any network access"""
+
+    def __init__(self, investigation_id: str) -> None:
+        self.folder = os.path.join(RESULTS_CACHE_FOLDER, investigation_id)
+        self._index_path = os.path.join(self.folder, "index.yml")
+        self._lock = Lock()
+        self._dirty = False
+        self.index: dict = {"csvs": {}, "metrics": {}}
+        if os.path.isfile(self._index_path):
+            with open(self._index_path, "r") as f:
+                self.index.update(yaml.safe_load(f) or {})
+
+    def get_csv(self, experiment_name: str, csv_name: str, etag: str) -> "Optional[tuple[str, pd.DataFrame]]":
+        """Returns the result name and parsed frame of a results csv if it was cached from the object with `etag`"""
+        entry = self.index["csvs"].get(f"{experiment_name}/{csv_name}")
+        if entry is None or entry["etag"] != etag or not os.path.isfile(self._path(entry["file"])):
+            return None
+        return entry["result_name"], self._read(entry["file"])
+
+    def put_csv(self, experiment_name: str, csv_name: str, etag: str, result_name: str, df: pd.DataFrame):
+        file_name = self._write(f"{experiment_name}.{csv_name}", df)
+        with self._lock:
+            self.index["csvs"][f"{experiment_name}/{csv_name}"] = {
+                "etag": etag,
+                "result_name": result_name,
+                "file": file_name,
+            }
+            self._dirty = True
+
+    def get_metrics(self, experiment_name: str, task_id: str) -> "Optional[dict[str, dict[str, dict]]]":
+        """Returns the last scalar metrics of an experiment in the layout given to put_metrics if they were cached
+        from task `task_id`"""
+        entry = self.index["metrics"].get(experiment_name)
+        if entry is None or entry["task_id"] != task_id or not os.path.isfile(self._path(entry["file"])):
+            return None
+        metrics: dict[str, dict[str, dict]] = {}
+        for record in self._read(entry["file"]).to_dict("records"):
+            metrics.setdefault(record["metric"], {})[record["variant"]] = {
+                "last": record["last"],
+                "min": record["min"],
+                "max": record["max"],
+            }
+        return metrics
+
+    def put_metrics(self, experiment_name: str, task_id: str, metrics: "dict[str, dict[str, dict]]"):
+        """Stores a task's last scalar metrics as one row per (metric, variant)"""
+        import pandas as pd
+
+        df = pd.DataFrame(
+            [
+                {"metric": metric, "variant": variant, **values}
+                for metric, variants in metrics.items()
+                for variant, values in variants.items()
+            ],
+            columns=["metric", "variant", "last", "min", "max"],
+        )
+        file_name = self._write(f"{experiment_name}.{METRICS_RESULT_NAME}", df)
+        with self._lock:
+            self.index["metrics"][experiment_name] = {"task_id": task_id, "file": file_name}
+            self._dirty = True
+
+    def load(self) -> "dict[str, pd.DataFrame]":
+        """Loads every cached result, concatenated per result name, without any network access. ClearML metrics
+        are returned under 'clearml_metrics' in long format with an experiment name column"""
+        import pandas as pd
+
+        frames: dict[str, list[pd.DataFrame]] = {}
+        for entry in self.index["csvs"].values():
+            if os.path.isfile(self._path(entry["file"])):
+                frames.setdefault(entry["result_name"], []).append(self._read(entry["file"]))
+        for experiment_name, entry in self.index["metrics"].items():
+            if os.path.isfile(self._path(entry["file"])):
+                df = self._read(entry["file"])
+                df.insert(0, "name", experiment_name)
+                frames.setdefault(METRICS_RESULT_NAME, []).append(df)
+        return {name: pd.concat(dfs, join="outer", ignore_index=True) for name, dfs in frames.items()}
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.folder, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=self.folder, prefix=".index.", delete=False) as f:
+                yaml.safe_dump(self.index, f)
+            os.replace(f.name, self._index_path)
+            self._dirty = False
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.folder, file_name)
+
+    def _read(self, file_name: str) -> pd.DataFrame:
+        import pandas as pd
+
+        if file_name.endswith(".parquet"):
+            return pd.read_parquet(self._path(file_name))
+        return pd.read_pickle(self._path(file_name))
+
+    def _write(self, stem: str, df: pd.DataFrame) -> str:
+        """Stores a frame as Parquet, or as a pandas pickle if it cannot be converted to Arrow"""
+        import pyarrow
+
+        file_name = f"{stem.replace('/', '_')}.parquet"
+        os.makedirs(self.folder, exist_ok=True)
+        try:
+            # Parquet needs string column names
+            df.rename(columns=str).to_parquet(self._path(file_name), index=False)
+            return file_name
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # Object columns mixing types, e.g. numbers and strings, have no Arrow type
+            file_name = f"{stem.replace('/', '_')}.pkl"
+        df.to_pickle(self._path(file_name))
+        return file_name
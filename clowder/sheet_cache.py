@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import os
+import pickle
+import tempfile
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SHEET_CACHE_FOLDER = "../.clowder/sheets"
+
+
+class SheetCache:
+    """On-disk copy of a spreadsheet's ExperimentsSetup records, keyed by the Drive revision of the spreadsheet it
+    was downloaded from. Any edit to the spreadsheet changes its revision, so a cached copy is only ever used while
+    the spreadsheet is unchanged"""
+
+    def __init__(self, sheet_id: str) -> None:
+        self.path = os.path.join(SHEET_CACHE_FOLDER, f"{sheet_id}.pkl")
+
+    def get(self, revision: str) -> Optional[pd.DataFrame]:
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                entry = pickle.load(f)
+        except Exception:
+            # A cache written by an incompatible pandas version is simply downloaded again
+            return None
+        if entry.get("revision") != revision:
+            return None
+        return entry["records"].copy()
+
+    def put(self, revision: str, records: pd.DataFrame):
+        os.makedirs(SHEET_CACHE_FOLDER, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=SHEET_CACHE_FOLDER, prefix=".sheet.", delete=False) as f:
+            pickle.dump({"revision": revision, "records": records}, f)
+        os.replace(f.name, self.path)
@@ -1,5 +1,10 @@
+from __future__ import annotations
+
 from enum import Enum
-from clearml import Task
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from clearml import Task
 
 
 class Status(Enum):
@@ -11,6 +16,8 @@ class Status(Enum):
 
     @staticmethod
     def from_clearml_task_statuses(statuses: "list[Task.TaskStatusEnum]", current_status: Enum) -> Enum:
+        from clearml import Task
+
         # "created", "in_progress", "stopped", "closed", "failed", "completed", "queued", "published", "publishing", "unknown"
         if len(statuses) == 0:
             return current_status
@@ -0,0 +1,70 @@
+import itertools
+import re
+from typing import Any, Collection, Iterator, Optional
+
+import yaml
+
+RANGE_PATTERN = re.compile(r"range\(\s*(-?\d+)\s*,\s*(-?\d+)\s*(?:,\s*(-?\d+)\s*)?\)")
+
+
+class EmptySweepError(ValueError):
+    """A sweep cell has no values, so its row would not describe any experiment"""
+
+    def __init__(self, column: str) -> None:
+        super().__init__(f"Sweep in column {column} has no values")
+        self.column = column
+
+
+def sweep_values(value: Any) -> Optional[list]:
+    """Values of a sweep cell, which is either a YAML list such as `[0.0001, 0.0005]` or `range(start, stop[, step])`
+    with integer bounds. Returns None for a cell holding a single value"""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    match = RANGE_PATTERN.fullmatch(value)
+    if match is not None:
+        return list(range(*(int(group) for group in match.groups() if group is not None)))
+    if value.startswith("[") and value.endswith("]"):
+        try:
+            parsed = yaml.safe_load(value)
+        except yaml.YAMLError:
+            return None
+        if isinstance(parsed, list):
+            return parsed
+    return None
+
+
+def expand(params: dict, name_column: str, fixed_columns: Collection[str] = ()) -> Iterator[dict]:
+    """Returns the parameters of every experiment described by a row of the ExperimentsSetup sheet: the row itself,
+    or one experiment per combination of the values of its sweep cells, named `<name>-<column>_<value>-...`.
+    Every cell holding a list or range is a sweep except those in `fixed_columns`. Raises EmptySweepError if a
+    sweep has no values"""
+    sweeps = {}
+    for column, value in params.items():
+        if column == name_column or column in fixed_columns:
+            continue
+        values = sweep_values(value)
+        if values is not None:
+            if len(values) == 0:
+                raise EmptySweepError(column)
+            sweeps[column] = values
+    return _combinations(params, name_column, sweeps)
+
+
+def _combinations(params: dict, name_column: str, sweeps: "dict[str, list]") -> Iterator[dict]:
+    if len(sweeps) == 0:
+        yield params
+        return
+    for combination in itertools.product(*sweeps.values()):
+        expanded = dict(params)
+        expanded.update(zip(sweeps.keys(), combination))
+        expanded[name_column] = "-".join(
+            [str(params[name_column])]
+            + [f"{column}_{_name_part(value)}" for column, value in zip(sweeps.keys(), combination)]
+        )
+        yield expanded
+
+
+def _name_part(value: Any) -> str:
+    # Experiment names become Drive folder names and S3 prefixes
+    return re.sub(r"[^\w.]+", "_", str(value)).strip("_")
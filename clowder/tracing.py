@@ -0,0 +1,128 @@
+import concurrent.futures
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Optional
+
+# Investigation the current call is made on behalf of, and the innermost open span
+_investigation: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("investigation", default=None)
+_span: "contextvars.ContextVar[Optional[dict]]" = contextvars.ContextVar("span", default=None)
+
+_stats: "dict[tuple[Optional[str], str], dict]" = {}
+_stats_lock = Lock()
+
+
+def _new_stats() -> dict:
+    return {"calls": 0, "errors": 0, "quota_errors": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0}
+
+
+def _record(operation: str, seconds: float, n_bytes: int, error: Optional[Exception]):
+    import quota
+
+    with _stats_lock:
+        stats = _stats.setdefault((_investigation.get(), operation), _new_stats())
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["bytes"] += n_bytes
+        if error is not None:
+            stats["errors"] += 1
+            if quota.is_quota_error(error):
+                stats["quota_errors"] += 1
+
+
+@contextmanager
+def span(operation: str):
+    """Records one call of `operation`, e.g. 'drive.list', with its latency, the bytes reported with
+    `add_bytes` while it is open and whether it failed"""
+    current = {"bytes": 0}
+    token = _span.set(current)
+    error = None
+    start = perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        seconds = perf_counter() - start
+        _span.reset(token)
+        _record(operation, seconds, current["bytes"], error)
+
+
+def traced(operation: str):
+    """Records every call of the decorated function as `operation`. Place it below `quota.throttled` so that time
+    spent waiting for the rate limiter is not counted and each retry is recorded as a call of its own"""
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(operation):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_bytes(n_bytes: int):
+    """Adds `n_bytes` transferred to the innermost open span"""
+    current = _span.get()
+    if current is not None:
+        current["bytes"] += n_bytes
+
+
+@contextmanager
+def investigation(investigation_name: str):
+    """Attributes every call made within the block, including those on ThreadPoolExecutor threads, to
+    `investigation_name`"""
+    token = _investigation.set(investigation_name)
+    try:
+        yield
+    finally:
+        _investigation.reset(token)
+
+
+def scoped(func: Callable) -> Callable:
+    """Attributes the calls made by an Investigation method to that investigation"""
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with investigation(self.name):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class ThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Runs each task in a copy of the submitting thread's context so calls keep their investigation"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def summary(by_investigation: bool = True) -> "list[dict]":
+    """Recorded stats, one row per investigation and operation (or per operation only), busiest first"""
+    rows: dict[tuple[Optional[str], str], dict] = {}
+    with _stats_lock:
+        for (investigation_name, operation), stats in _stats.items():
+            key = (investigation_name if by_investigation else None, operation)
+            row = rows.setdefault(key, _new_stats())
+            for field in ("calls", "errors", "quota_errors", "seconds", "bytes"):
+                row[field] += stats[field]
+            row["max_seconds"] = max(row["max_seconds"], stats["max_seconds"])
+    return sorted(
+        (
+            {"investigation": investigation_name, "operation": operation, **stats}
+            for (investigation_name, operation), stats in rows.items()
+        ),
+        key=lambda row: row["seconds"],
+        reverse=True,
+    )
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()